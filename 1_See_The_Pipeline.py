@@ -1,7 +1,11 @@
 import streamlit as st
+import os
 import time
 import subprocess
 import sys
+import tempfile
+from dashboard_data import clear_dashboard_cache
+from progress_events import read_events, reset_progress
 
 
 st.set_page_config(page_title='ETL Pipeline' ,layout="wide",page_icon='🔁')
@@ -34,18 +38,19 @@ def card(wch_colour_box, wch_colour_font, sline, i, iconname=None):
 
 
 
-# Loads environmental vars from secrets.toml
+def stage_card(stage):
+      """Index of the flow step card of a pipeline stage"""
+      if stage == "download":
+            return 0
+      if stage in ("parse", "raw load", "raw cache"):
+            return 1
+      if stage == "transform":
+            return 2
+      if stage.startswith("write") or stage in ("indexes", "refresh views", "swap"):
+            return 3
+      return None
+
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
 
 # Building app
 st.title("ETL Pipeline - Austin Crime Database 👮‍♂️")
@@ -132,44 +137,63 @@ with col1:
                     card_colors = [(46, 216, 182), (255, 182, 77), (255, 83, 112), (64, 153, 255)]
                     st.markdown(card((64, 153, 255),(255,255,255), "", "Pipeline Started"), unsafe_allow_html=True)
                     st.markdown("<div style='text-align: center; font-size: 30px;'>🔽</div>", unsafe_allow_html=True)
-                    # Start actual pipeline workflow with stdout showing in expander 'log1'
+                    cards = st.container()
+                    progress_bar = st.progress(0.0, text="Starting pipeline...")
+                    throughput = st.empty()
+                    # Start actual pipeline workflow; its log goes to a file shown in expander 'log1' and
+                    # its progress events to the progress file, both read without waiting on the pipeline
+                    reset_progress()
+                    log_file = tempfile.NamedTemporaryFile(mode="w", suffix=".log", delete=False)
                     command = [f"{sys.executable}", '-u', 'etl-workflow.py']
-                    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-                    i = 0 # Index to control which flow step to show
-                    flowstep = False # flag to check if a flow step has been printed (and not reapeat it)
-                    while process.poll() is None:
-                        # Reading the stdout line of text
-                        line = process.stdout.readline()
-                        flowstep = False
-                        # Showing pretty cards with flow steps
-                        if "json file downloaded successfully" in line:
-                            i = 0
-                            flowstep = True
-                        elif "created in postgreSQL" in line:
-                            i = 1
-                            flowstep = True
-                        elif "loaded successfully from postgresql" in line:
-                            i = 2
-                            flowstep = True
-                        elif "Finished creating final transformed tables" in line:
-                            i = 3
-                            flowstep = True
-                            st.secrets.finished_workflow = 'true'
-                        elif  "'All states completed.'" in line:
-                            i = 4
-                            flowstep = True
-                        # continue with if's, if sql in line i = 1 ......
-                        if i != 4 and flowstep:
-                            st.markdown (card(card_colors[i], (255,255,255), msg[i], small_msg[i]), unsafe_allow_html=True)
-                            st.markdown("<div style='text-align: center; font-size: 30px;'>🔽</div>", unsafe_allow_html=True)
-                            time.sleep(0.5)
-                        # writing the line in the app
-                        if not line:
-                            continue
-                        with log1:
-                            log1.write(line.strip())
+                    process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, universal_newlines=True)
+                    events_position = 0
+                    shown_cards = set()
+                    totals = {}
+                    stage_times = []
+                    with open(log_file.name) as log_reader:
+                        while True:
+                            running = process.poll() is None
+                            events, events_position = read_events(events_position)
+                            for event in events:
+                                stage = event["stage"]
+                                if event["event"] == "stage_start":
+                                    # Showing pretty cards with flow steps
+                                    i = stage_card(stage)
+                                    if i is not None and i not in shown_cards:
+                                        shown_cards.add(i)
+                                        with cards:
+                                            st.markdown (card(card_colors[i], (255,255,255), msg[i], small_msg[i]), unsafe_allow_html=True)
+                                            st.markdown("<div style='text-align: center; font-size: 30px;'>🔽</div>", unsafe_allow_html=True)
+                                    progress_bar.progress(0.0, text=f"{stage}...")
+                                elif event["event"] == "total":
+                                    totals[stage] = event["rows"]
+                                elif event["event"] == "progress":
+                                    total = event.get("total") or totals.get(stage)
+                                    rate = event["rows"] / event["seconds"] if event["seconds"] else 0
+                                    text = f"{stage}: {event['rows']:,} rows" + (f" of {total:,}" if total else "") + f" | {rate:,.0f} rows/s"
+                                    progress_bar.progress(min(event["rows"] / total, 1.0) if total else 0.0, text=text)
+                                elif event["event"] == "stage_end":
+                                    rows = event["rows_out"] if event["rows_out"] is not None else event["rows_in"]
+                                    stage_times.append({
+                                        "stage": stage,
+                                        "seconds": round(event["seconds"], 2),
+                                        "rows": rows,
+                                        "rows/s": round(rows / event["seconds"]) if rows and event["seconds"] else None,
+                                    })
+                                    throughput.dataframe(stage_times, hide_index=True)
+                                elif event["event"] == "run_end" and event["status"] in ("succeeded", "not modified"):
+                                    st.secrets.finished_workflow = 'true'
+                            # writing the new log lines in the app
+                            for line in log_reader.readlines():
+                                if line.strip():
+                                    with log1:
+                                        log1.write(line.strip())
+                            if not running:
+                                break
+                            time.sleep(0.25)
+                    os.remove(log_file.name)
                     # end of pipeline workflow execution
+                    progress_bar.progress(1.0, text="Done")
                     st.markdown(card((46, 216, 182),(255,255,255), "", "Pipeline Finished!"), unsafe_allow_html=True)
                     status.update(label="Pipeline finished!", state="complete", expanded=True)
-                    
-
+                    clear_dashboard_cache()
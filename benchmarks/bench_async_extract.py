@@ -0,0 +1,83 @@
+"""
+Compares fetching pages one after another with the async extract engine, against a local stub
+of the Socrata API that answers each request after a fixed latency. The stub serves the records
+of data/austin_crime.json; tests/test_extract_async.py checks the pages arrive complete and in order.
+Run from the repository root: python benchmarks/bench_async_extract.py [latency_ms ...]
+"""
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extract_json_to_postgres import fetch_pages
+from extract_async import fetch_pages_async
+
+page_size = 50
+with open("data/austin_crime.json") as file:
+    records = json.load(file)
+
+
+def start_stub_server(latency: float):
+    """
+    Stub of the Socrata API: $limit/$offset pages and $select=count(*), after latency seconds
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            time.sleep(latency)
+            if params.get("$select", "").startswith("count"):
+                body = [{"count": str(len(records))}]
+            else:
+                offset, limit = int(params["$offset"]), int(params["$limit"])
+                body = records[offset:offset + limit]
+            content = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/resource/stub.json"
+
+
+def fetch_all(pages) -> list:
+    fetched = []
+    for page, _ in pages:
+        fetched.extend(page)
+        if len(page) < page_size:
+            pages.close()
+            break
+    return fetched
+
+
+def bench(latency_ms: int):
+    server, api_url = start_stub_server(latency_ms / 1000)
+    engines = [("sync", lambda: fetch_pages(api_url, 0, page_size))]
+    for concurrency in [2, 4, 8]:
+        engines.append((
+            f"async x{concurrency}",
+            lambda concurrency=concurrency: fetch_pages_async(api_url, 0, page_size, concurrency=concurrency, requests_per_second=0),
+        ))
+    n_pages = len(records) // page_size + 1
+    for name, pages in engines:
+        start = time.perf_counter()
+        fetch_all(pages())
+        seconds = time.perf_counter() - start
+        print(f"{latency_ms:>5} ms latency | {n_pages} pages | {name:<9} | {seconds:6.2f}s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    latencies = [int(arg) for arg in sys.argv[1:]] or [20, 100]
+    for latency_ms in latencies:
+        bench(latency_ms)
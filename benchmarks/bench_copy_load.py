@@ -0,0 +1,56 @@
+"""
+Compares DataFrame.to_sql with the COPY bulk loader at 10k, 100k and 1M rows.
+Run from the repository root: python benchmarks/bench_copy_load.py [n_rows ...]
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_load_postgres import copy_df_to_postgres
+from config import get_engine
+
+
+def make_df(n_rows: int):
+    """
+    Dataframe shaped like the raw crime table
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("2003-01-01") + pd.to_timedelta(rng.integers(0, 21 * 365 * 24 * 60, n_rows), unit="min")
+    return pd.DataFrame({
+        "incident_report_number": np.arange(n_rows, dtype="int64") + 2003000000000,
+        "address": rng.choice(["1301 RADCLIFF DR", "12330 METRIC BLVD", "500 E 7TH ST"], n_rows),
+        "crime_type": rng.choice(["THEFT", "BURGLARY OF VEHICLE", "ASSAULT W/INJURY-FAM/DATE VIOL"], n_rows),
+        "district": rng.choice(["1", "2", "3", "4", "AP"], n_rows),
+        "rep_date_time": dates,
+        "latitude": rng.uniform(30.1, 30.5, n_rows),
+        "longitude": rng.uniform(-97.9, -97.6, n_rows),
+    })
+
+
+def bench(n_rows: int):
+    df = make_df(n_rows)
+
+    start = time.perf_counter()
+    df.to_sql(name="bench_to_sql", con=get_engine(), if_exists="replace", index=False)
+    to_sql_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with get_engine().begin() as conn:
+        copy_df_to_postgres(df, "bench_copy", conn)
+    copy_seconds = time.perf_counter() - start
+
+    with get_engine().begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS "bench_to_sql", "bench_copy";'))
+
+    print(f"{n_rows:>9} rows | to_sql {to_sql_seconds:8.2f}s ({n_rows / to_sql_seconds:>9.0f} rows/s) "
+          f"| COPY {copy_seconds:8.2f}s ({n_rows / copy_seconds:>9.0f} rows/s) | {to_sql_seconds / copy_seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -0,0 +1,44 @@
+"""
+Payload sent to the map: every geocoded point (df_geo) against the grid cells of one zoom level,
+for random points spread over Austin.
+Run from the repository root: python benchmarks/bench_geo_grid.py [n_rows ...]
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transform_create_dfs import create_geo_grid, grid_cell_sizes
+
+
+def make_df_geo(n_rows: int):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "crime_type": rng.choice(["THEFT", "BURGLARY OF VEHICLE", "CRIMINAL MISCHIEF", "ASSAULT WITH INJURY"], n_rows),
+        "district": rng.choice(["1", "2", "3", "4", "5", "6", "7", "8", "9", "AP"], n_rows),
+        "latitude": rng.normal(30.29, 0.08, n_rows),
+        "longitude": rng.normal(-97.74, 0.08, n_rows),
+    })
+
+
+def bench(n_rows: int):
+    df_geo = make_df_geo(n_rows)
+    points_bytes = len(df_geo[["latitude", "longitude"]].to_json(orient="records"))
+
+    start = time.perf_counter()
+    df_grid = create_geo_grid(df_geo)
+    seconds = time.perf_counter() - start
+
+    print(f"{n_rows:>9} points | binning {seconds:6.2f}s | points payload {points_bytes / 1e6:8.2f} MB")
+    for cell_size in grid_cell_sizes:
+        df_cells = df_grid[df_grid["cell_size"] == cell_size].groupby(["latitude", "longitude"], as_index=False)["number_of_crimes"].sum()
+        cells_bytes = len(df_cells.to_json(orient="records"))
+        print(f"{'':>16} cell {cell_size:<6} | {len(df_cells):>6} cells | {cells_bytes / 1e6:8.3f} MB | {points_bytes / cells_bytes:7.0f}x smaller")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -0,0 +1,54 @@
+"""
+Helpers shared by the benchmarks: settings that keep a benchmark away from the tables and files
+of the app, clean-up of its tables, and the memory counters of /proc/self/status (Linux only).
+"""
+import os
+import tempfile
+from sqlalchemy import text
+
+bench_table_id = "bench_austin_crime"
+
+
+def use_bench_settings() -> str:
+    """
+    Point table_id, dataset_id and dest_folder at the benchmark table id and a new temporary
+    folder, which is returned. config reads the env vars named as in secrets.toml before any
+    other setting, whatever the environment already holds. Call before importing config.
+    """
+    folder = tempfile.mkdtemp()
+    os.environ.update({"table_id": bench_table_id, "dataset_id": bench_table_id, "dest_folder": folder})
+    return folder
+
+
+def drop_bench_tables(engine, prefix: str):
+    """
+    Drop the tables whose name starts with prefix, which must be a benchmark table id
+    """
+    if not prefix.startswith("bench_"):
+        raise ValueError(f"Refusing to drop the tables '{prefix}*': not a benchmark table id")
+    with engine.begin() as conn:
+        names = conn.execute(
+            text("SELECT tablename FROM pg_tables WHERE tablename LIKE :prefix ESCAPE '\\';"),
+            {"prefix": prefix.replace("_", "\\_") + "%"},
+        ).scalars().all()
+        for name in names:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE;'))
+
+
+def memory_status(field: str) -> float:
+    """
+    A memory counter of the process in MB, e.g. VmRSS or VmHWM (its peak)
+    """
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1e3  # kB to MB
+
+
+def reset_peak_rss() -> float:
+    """
+    Reset the peak RSS (VmHWM) to the current RSS, which is returned
+    """
+    with open("/proc/self/clear_refs", "w") as file:
+        file.write("5")
+    return memory_status("VmRSS")
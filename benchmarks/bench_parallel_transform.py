@@ -0,0 +1,68 @@
+"""
+Critical path of the pandas transform: the staging tables written one after another (as
+create_dfs_to_postgres_main does) against one thread per table sharing the cleaned frame
+(as the tasks of etl-workflow.py do), on a raw table of synthetic records
+(benchmarks/synthetic_data.py).
+
+Tables are written under the 'bench_austin_crime' table id (see bench_helpers.py) and dropped
+at the end, so the staging tables of a pipeline run are left alone.
+Run from the repository root: python benchmarks/bench_parallel_transform.py 100000
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_helpers import drop_bench_tables, use_bench_settings
+
+folder = use_bench_settings()  # raw cache and progress file of the benchmark
+from synthetic_data import write_json_file
+from extract_json_to_postgres import write_to_postgres
+from load_dfs_to_postgres import derived_tables, write_derived_table, write_detailed_table
+from transform_create_dfs import create_base_df
+from config import table_id, get_engine
+
+
+def write_table(name):
+    start = time.perf_counter()
+    tablenames = write_detailed_table(main_df) if name is None else write_derived_table(name, main_df)
+    return tablenames, time.perf_counter() - start
+
+
+def bench(n_rows: int):
+    global main_df
+    write_to_postgres(write_json_file(os.path.join(folder, "bench_austin_crime.json"), n_rows))
+    start = time.perf_counter()
+    main_df, logger_msg = create_base_df(get_engine())
+    print(f"{logger_msg} ({len(main_df)} rows) in {time.perf_counter() - start:.2f}s")
+    names = [None] + list(derived_tables)
+
+    start = time.perf_counter()
+    results = [write_table(name) for name in names]
+    sequential_seconds = time.perf_counter() - start
+    for tablenames, seconds in results:
+        print(f"{', '.join(tablenames):<60} {seconds:6.2f}s")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        results = list(executor.map(write_table, names))
+    parallel_seconds = time.perf_counter() - start
+    print(f"one after another {sequential_seconds:6.2f}s | concurrent {parallel_seconds:6.2f}s "
+          f"| longest table {max(seconds for _, seconds in results):6.2f}s | {sequential_seconds / parallel_seconds:4.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Staging table writes one after another against concurrent ones")
+    parser.add_argument("n_rows", type=int, nargs="?", default=100_000, help="synthetic records in the raw table")
+    args = parser.parse_args()
+
+    print(f"{args.n_rows:,} synthetic records, tables '{table_id}*'")
+    try:
+        bench(args.n_rows)
+    finally:
+        drop_bench_tables(get_engine(), table_id)
+        shutil.rmtree(folder, ignore_errors=True)
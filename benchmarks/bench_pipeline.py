@@ -0,0 +1,116 @@
+"""
+End-to-end benchmark of the pipeline on synthetic records (benchmarks/synthetic_data.py):
+write_to_postgres, create_base_df, every transform function and the load step, one stage after
+another, each with its wall time, throughput and peak memory (the growth of the process peak RSS
+during the stage, reset through /proc/self/clear_refs, so Linux only).
+
+Tables are written under the 'bench_austin_crime' table id, whatever table_id the environment
+or secrets.toml set, and dropped at the end, and the files go to a temporary folder, so the
+tables and files of the app are left alone. Postgres is the one configured in
+.streamlit/secrets.toml or the POSTGRES_* environment variables, e.g. a local docker container.
+
+With --baseline, stages slower or larger than the baseline by more than --time-threshold or
+--memory-threshold are listed and the exit status is 1. --save writes the results as a baseline.
+Run from the repository root:
+    python benchmarks/bench_pipeline.py 100000 --save benchmarks/baseline_100k.json
+    python benchmarks/bench_pipeline.py 100000 --baseline benchmarks/baseline_100k.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_helpers import drop_bench_tables, memory_status, reset_peak_rss, use_bench_settings
+
+folder = use_bench_settings()  # raw cache and progress file of the benchmark
+from synthetic_data import write_json_file
+from extract_json_to_postgres import write_to_postgres
+from transform_create_dfs import (
+    create_base_df,
+    create_df_geo,
+    create_geo_grid,
+    create_crimes_per_hour,
+    create_crimes_per_year,
+    top_crimes,
+    create_crime_cube,
+)
+from load_dfs_to_postgres import derived_tables, swap_tables_into_place, write_derived_table, write_detailed_table
+from config import table_id, get_engine
+
+
+def measure(results: dict, name: str, rows: int, function, *args):
+    """
+    Run one stage, record its seconds, rows/s and peak memory, and return its result
+    """
+    baseline = reset_peak_rss()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    results[name] = {"seconds": seconds, "rows_per_second": rows / seconds, "peak_mb": memory_status("VmHWM") - baseline}
+    print(f"{name:<24} {seconds:8.2f}s | {rows / seconds:>12,.0f} rows/s | peak memory {results[name]['peak_mb']:8.1f} MB")
+    return result
+
+
+def run_pipeline(n_rows: int) -> dict:
+    path = os.path.join(folder, "bench_austin_crime.json")
+    write_json_file(path, n_rows)
+    results = {}
+    measure(results, "write_to_postgres", n_rows, write_to_postgres, path)
+    main_df, logger_msg = measure(results, "create_base_df", n_rows, create_base_df, get_engine())
+    if "successfully" not in logger_msg:
+        raise RuntimeError(logger_msg)
+    df_geo = measure(results, "create_df_geo", n_rows, create_df_geo, main_df)
+    measure(results, "create_geo_grid", len(df_geo), create_geo_grid, df_geo)
+    measure(results, "create_crimes_per_hour", n_rows, create_crimes_per_hour, main_df)
+    measure(results, "create_crimes_per_year", n_rows, create_crimes_per_year, main_df)
+    measure(results, "top_crimes", n_rows, top_crimes, main_df)
+    measure(results, "create_crime_cube", n_rows, create_crime_cube, main_df)
+    tablenames = measure(results, "write detailed", n_rows, write_detailed_table, main_df)
+    for name in derived_tables:
+        tablenames += measure(results, f"write {name}", n_rows, write_derived_table, name, main_df)
+    logger_msg = measure(results, "swap", n_rows, swap_tables_into_place, tablenames, logger_msg)
+    if "Error" in logger_msg:
+        raise RuntimeError(logger_msg)
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, time_threshold: float, memory_threshold: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result["seconds"] > baseline[name]["seconds"] * (1 + time_threshold):
+            regressions.append(f"{name}: {result['seconds']:.2f}s against {baseline[name]['seconds']:.2f}s")
+        if result["peak_mb"] > max(baseline[name]["peak_mb"], 1) * (1 + memory_threshold):
+            regressions.append(f"{name}: {result['peak_mb']:.1f} MB against {baseline[name]['peak_mb']:.1f} MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic records")
+    parser.add_argument("n_rows", type=int, nargs="?", default=100_000, help="10k to 10M rows")
+    parser.add_argument("--baseline", help="json results of a previous run to compare with")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed memory growth, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    print(f"{args.n_rows:,} synthetic records, tables '{table_id}*'")
+    try:
+        results = run_pipeline(args.n_rows)
+    finally:
+        drop_bench_tables(get_engine(), table_id)
+        shutil.rmtree(folder, ignore_errors=True)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.time_threshold, args.memory_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,85 @@
+"""
+Compares re-parsing the raw json extract with reading the Parquet cache of raw_cache.py (whole,
+column-pruned and one year), on data/austin_crime.json repeated to the requested number of rows.
+Each read runs in its own process, and its peak memory is the growth of the process peak RSS
+(reset through /proc/self/clear_refs, so Linux only) while reading.
+Run from the repository root: python benchmarks/bench_raw_cache.py [n_rows ...]
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_helpers import memory_status, reset_peak_rss
+from crime_schema import apply_schema, raw_columns, source_columns
+from raw_cache import read_raw_cache, write_raw_cache
+
+
+def make_files(n_rows: int):
+    """
+    Json file and Parquet cache of n_rows records, each with its own incident_report_number
+    """
+    with open("data/austin_crime.json") as file:
+        records = json.load(file)
+    folder = tempfile.mkdtemp()
+    json_path = os.path.join(folder, "austin_crime.json")
+    with open(json_path, "w") as file:
+        json.dump([dict(records[i % len(records)], incident_report_number=str(i)) for i in range(n_rows)], file)
+    cache_path = os.path.join(folder, "austin_crime_parquet")
+    write_raw_cache(read_json(json_path), cache_path)
+    return folder, json_path, cache_path
+
+
+def read_json(path: str):
+    df = pd.read_json(path, dtype=False, convert_dates=False)
+    return apply_schema(df.rename(columns=source_columns).reindex(columns=raw_columns))
+
+
+def read_columns(path: str):
+    return read_raw_cache(path, columns=["crime_type", "occ_date"])
+
+
+def read_year(path: str):
+    return read_raw_cache(path, years=[2024])
+
+
+def measure(read, path: str, queue):
+    baseline = reset_peak_rss()
+    start = time.perf_counter()
+    df = read(path)
+    seconds = time.perf_counter() - start
+    queue.put((seconds, memory_status("VmHWM") - baseline, len(df)))
+
+
+def bench(n_rows: int):
+    folder, json_path, cache_path = make_files(n_rows)
+    readers = [
+        ("json", read_json, json_path),
+        ("parquet", read_raw_cache, cache_path),
+        ("2 cols", read_columns, cache_path),
+        ("1 year", read_year, cache_path),
+    ]
+    json_megabytes = os.path.getsize(json_path) / 1e6
+    cache_megabytes = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache_path) for name in names) / 1e6
+    print(f"{n_rows:>9} rows | json {json_megabytes:8.1f} MB on disk | parquet {cache_megabytes:8.1f} MB on disk")
+    context = multiprocessing.get_context("fork")
+    for name, read, path in readers:
+        queue = context.Queue()
+        process = context.Process(target=measure, args=(read, path, queue))
+        process.start()
+        seconds, peak_megabytes, rows = queue.get()
+        process.join()
+        print(f"{'':>14} {name:<8} | {seconds:7.2f}s | peak memory {peak_megabytes:8.1f} MB | {rows:>9} rows")
+    shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -0,0 +1,55 @@
+"""
+Compares the memory and parse time of today's untyped frames with the declared schema in
+crime_schema.py, on data/austin_crime.json repeated to the requested number of rows.
+Run from the repository root: python benchmarks/bench_schema.py [n_rows ...]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crime_schema import apply_schema, raw_columns, source_columns
+
+
+def make_json_file(n_rows: int) -> str:
+    with open("data/austin_crime.json") as file:
+        records = json.load(file)
+    path = os.path.join(tempfile.mkdtemp(), "austin_crime.json")
+    with open(path, "w") as file:
+        json.dump([records[i % len(records)] for i in range(n_rows)], file)
+    return path
+
+
+def untyped(path: str):
+    """
+    Parse as the pipeline did before the schema: dtype inference, then date format inference
+    """
+    df = pd.read_json(path).reindex(columns=raw_columns)
+    for column in ["occ_date", "rep_date_time", "clearance_date"]:
+        df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def typed(path: str):
+    df = pd.read_json(path, dtype=False, convert_dates=False)
+    return apply_schema(df.rename(columns=source_columns).reindex(columns=raw_columns))
+
+
+def bench(n_rows: int):
+    path = make_json_file(n_rows)
+    for name, parse in [("untyped", untyped), ("schema", typed)]:
+        start = time.perf_counter()
+        df = parse(path)
+        seconds = time.perf_counter() - start
+        megabytes = df.memory_usage(deep=True).sum() / 1e6
+        print(f"{n_rows:>9} rows | {name:<8} | {seconds:7.2f}s | {megabytes:9.1f} MB")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
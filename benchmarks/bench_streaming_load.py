@@ -0,0 +1,99 @@
+"""
+Compares the peak memory of the two raw load engines on a synthetic json file
+(benchmarks/synthetic_data.py, about 650 bytes per record, so 3M records make a 2 GB file):
+'pandas' parses the whole file into a dataframe before copying it to Postgres, 'stream' parses
+it record by record and copies batches of chunk_size rows. Each load runs in its own process,
+and its peak memory is the growth of the process peak RSS (reset through /proc/self/clear_refs,
+so Linux only) during the load.
+
+Tables are written under the 'bench_austin_crime' table id (see bench_helpers.py) and dropped
+at the end. With --parse-only no database is needed: the csv batches are built but not sent.
+Run from the repository root:
+    python benchmarks/bench_streaming_load.py 3000000
+    python benchmarks/bench_streaming_load.py 500000 --parse-only
+"""
+import argparse
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_helpers import drop_bench_tables, memory_status, reset_peak_rss, use_bench_settings
+
+folder = use_bench_settings()  # raw cache and progress file of the benchmark
+import pandas as pd
+from synthetic_data import write_json_file
+from extract_json_to_postgres import iter_raw_rows, project_raw_columns, stream_to_postgres, write_to_postgres
+from config import chunk_size, table_id, get_engine
+
+
+def parse_pandas(path: str) -> int:
+    """
+    write_to_postgres without the database: the projected dataframe written as csv batches
+    """
+    df = project_raw_columns(pd.read_json(path, dtype=False, convert_dates=False))
+    for start in range(0, len(df), chunk_size):
+        df.iloc[start:start + chunk_size].to_csv(io.StringIO(), index=False, header=False)
+    return len(df)
+
+
+def parse_stream(path: str) -> int:
+    """
+    stream_to_postgres without the database: the parsed rows written as csv batches
+    """
+    with open(path, "rb") as file:
+        rows = iter_raw_rows(file, {"records": 0, "high_water_mark": None})
+        n_rows = 0
+        while batch := list(itertools.islice(rows, chunk_size)):
+            csv.writer(io.StringIO()).writerows(batch)
+            n_rows += len(batch)
+    return n_rows
+
+
+def measure(load, path: str, queue):
+    baseline = reset_peak_rss()
+    start = time.perf_counter()
+    load(path)
+    queue.put((time.perf_counter() - start, memory_status("VmHWM") - baseline))
+
+
+def bench(n_rows: int, parse_only: bool):
+    path = write_json_file(os.path.join(folder, "bench_austin_crime.json"), n_rows)
+    print(f"{n_rows:,} synthetic records | json {os.path.getsize(path) / 1e9:.2f} GB on disk | batches of {chunk_size:,} rows")
+    if parse_only:
+        loads = [("pandas", parse_pandas), ("stream", parse_stream)]
+    else:
+        loads = [("pandas", write_to_postgres), ("stream", stream_to_postgres)]
+    context = multiprocessing.get_context("fork")
+    for name, load in loads:
+        queue = context.Queue()
+        process = context.Process(target=measure, args=(load, path, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"{name:<8} | failed with exit code {process.exitcode} (out of memory?)")
+            continue
+        seconds, peak_megabytes = queue.get()
+        print(f"{name:<8} | {seconds:8.2f}s | {n_rows / seconds:>10,.0f} rows/s | peak memory {peak_megabytes:8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of the pandas and streaming raw loads")
+    parser.add_argument("n_rows", type=int, nargs="?", default=3_000_000, help="3M records make a 2 GB file")
+    parser.add_argument("--parse-only", action="store_true", help="parse and build the csv batches without loading them")
+    args = parser.parse_args()
+
+    try:
+        bench(args.n_rows, args.parse_only)
+    finally:
+        if not args.parse_only:
+            drop_bench_tables(get_engine(), table_id)
+        shutil.rmtree(folder, ignore_errors=True)
+    if not args.parse_only:
+        print(f"tables '{table_id}*' dropped")
@@ -0,0 +1,99 @@
+"""
+Synthetic Austin crime records shaped like the API json, at any number of rows.
+Descriptive fields (crime type, location type, district, address, ...) are copied together from
+a random record of data/austin_crime.json, so their joint distribution and null rates are the
+real ones. Identifiers are unique, dates are spread over the years of the sample, and coordinates
+are sample points in Austin moved by a few hundred meters, with the sample's shares of missing
+and out-of-bounds (0, 0) points.
+Run from the repository root: python benchmarks/synthetic_data.py n_rows path
+"""
+import json
+import sys
+import numpy as np
+import pandas as pd
+
+sample_path = "data/austin_crime.json"
+
+# Fields generated for each record instead of copied from the sample
+generated_fields = [
+    "incident_report_number", "occ_date", "occ_time", "occ_date_time", "rep_date", "rep_time", "rep_date_time",
+    "clearance_date", "latitude", "longitude", "location", "x_coordinate", "y_coordinate",
+]
+jitter_degrees = 0.005
+
+
+def in_bounds(latitude, longitude):
+    """
+    Same bounds as create_df_geo
+    """
+    return (latitude >= 28) & (latitude <= 32) & (longitude >= -99) & (longitude <= -95)
+
+
+def load_sample(path: str = sample_path):
+    with open(path) as file:
+        return pd.DataFrame(json.load(file))
+
+
+def make_batch(sample, start: int, n_rows: int, rng):
+    """
+    Records start to start + n_rows as a dataframe of json strings (NaN where the field is missing)
+    """
+    df = sample.drop(columns=[column for column in generated_fields if column in sample.columns])
+    df = df.iloc[rng.integers(0, len(sample), n_rows)].reset_index(drop=True)
+
+    years = pd.to_datetime(sample["occ_date"]).dt.year.to_numpy()
+    year = rng.choice(years, n_rows)
+    occurred = pd.to_datetime(year.astype(str), format="%Y") + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n_rows), unit="min")
+    reported = occurred + pd.to_timedelta(rng.exponential(2 * 24 * 60, n_rows).astype("int64"), unit="min")
+    cleared = reported + pd.to_timedelta(rng.exponential(30 * 24 * 60, n_rows).astype("int64"), unit="min")
+    df["incident_report_number"] = (year.astype("int64") * 10**9 + np.arange(start, start + n_rows)).astype(str)
+    df["occ_date"] = socrata_timestamps(occurred.normalize())
+    df["occ_time"] = occurred.strftime("%H%M")
+    df["occ_date_time"] = socrata_timestamps(occurred)
+    df["rep_date"] = socrata_timestamps(reported.normalize())
+    df["rep_time"] = reported.strftime("%H%M")
+    df["rep_date_time"] = socrata_timestamps(reported)
+    df["clearance_date"] = np.where(df["clearance_status"].notna(), socrata_timestamps(cleared), None)
+
+    latitude = pd.to_numeric(sample["latitude"], errors="coerce")
+    longitude = pd.to_numeric(sample["longitude"], errors="coerce")
+    points = in_bounds(latitude, longitude)
+    picked = rng.integers(0, points.sum(), n_rows)
+    lat = latitude[points].to_numpy()[picked] + rng.normal(0, jitter_degrees, n_rows)
+    lon = longitude[points].to_numpy()[picked] + rng.normal(0, jitter_degrees, n_rows)
+    draw = rng.random(n_rows)
+    missing = draw < latitude.isna().mean()
+    out_of_bounds = ~missing & (draw < latitude.isna().mean() + (latitude.notna() & ~points).mean())
+    lat[out_of_bounds], lon[out_of_bounds] = 0.0, 0.0
+    df["latitude"] = pd.Series(lat.round(8)).astype(str).where(~missing)
+    df["longitude"] = pd.Series(lon.round(8)).astype(str).where(~missing)
+    return df
+
+
+def socrata_timestamps(dates):
+    """
+    Format dates as Socrata floating timestamps, e.g. 2003-02-10T12:07:00.000
+    """
+    return np.datetime_as_string(dates.to_numpy(dtype="datetime64[ms]"), unit="ms")
+
+
+def write_json_file(path: str, n_rows: int, batch_size: int = 100_000, seed: int = 0):
+    """
+    Write n_rows synthetic records as one json array, batch by batch, so memory does not
+    grow with n_rows
+    """
+    sample = load_sample()
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as file:
+        file.write("[")
+        for start in range(0, n_rows, batch_size):
+            batch = make_batch(sample, start, min(batch_size, n_rows - start), rng)
+            if start > 0:
+                file.write(", ")
+            file.write(batch.to_json(orient="records")[1:-1])
+        file.write("]")
+    return path
+
+
+if __name__ == "__main__":
+    write_json_file(sys.argv[2], int(sys.argv[1]))
@@ -0,0 +1,168 @@
+"""
+Bulk loads dataframes into Postgres tables with COPY FROM STDIN, streaming them through an
+in-memory csv buffer instead of sending row by row INSERTs like DataFrame.to_sql.
+Rows that arrive one by one (e.g. parsed from a json stream) are loaded in batches the same way.
+"""
+import csv
+import io
+import itertools
+import pandas as pd
+from pandas.api import types
+from sqlalchemy import text
+from pipeline_metrics import count_round_trips, report_progress
+
+
+def postgres_type(dtype) -> str:
+    """
+    Get the Postgres column type for a pandas dtype
+    """
+    if types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return "TIMESTAMPTZ"
+    if types.is_datetime64_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def read_column_types(conn, table_name: str) -> dict:
+    """
+    Get the column types of an existing table (works for temporary tables too)
+    """
+    rows = conn.execute(
+        text(
+            "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = CAST(:table_name AS regclass) AND attnum > 0 AND NOT attisdropped;"
+        ),
+        {"table_name": f'"{table_name}"'},
+    ).fetchall()
+    return dict(rows)
+
+
+def prepare_df(df, column_types: dict):
+    """
+    Make the csv text of each column parseable by its Postgres type: floats holding integer
+    columns with missing values are written as integers, not as '433.0'
+    """
+    df = df.copy(deep=False)
+    for column, column_type in column_types.items():
+        if column in df.columns and ("INT" in column_type.upper()) and types.is_float_dtype(df[column].dtype):
+            df[column] = df[column].round().astype("Int64")
+    return df
+
+
+def copy_df_to_postgres(df, table_name: str, conn, if_exists: str = "replace", column_types: dict = None, index: bool = False, chunksize: int = 100000):
+    """
+    Write a dataframe to a Postgres table with COPY FROM STDIN.
+    conn is a SQLAlchemy connection, so the load runs inside the caller's transaction.
+    if_exists behaves as in DataFrame.to_sql ('replace' or 'append'); column_types maps
+    column names to explicit Postgres types, the rest are derived from the dataframe dtypes.
+    """
+    if index:
+        df = df.reset_index()  # same as to_sql: an unnamed index becomes the 'index' column
+    if if_exists == "append":
+        column_types = {**read_column_types(conn, table_name), **(column_types or {})}
+    else:
+        column_types = {
+            column: (column_types or {}).get(column, postgres_type(df[column].dtype))
+            for column in df.columns
+        }
+        columns_ddl = ", ".join(f'"{column}" {column_types[column]}' for column in df.columns)
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}";'))
+        conn.execute(text(f'CREATE TABLE "{table_name}" ({columns_ddl});'))
+
+    df = prepare_df(df, column_types)
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    copy_sql = f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, len(df), chunksize):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            count_round_trips()  # raw cursor calls are not seen by the engine events
+            report_progress(min(start + chunksize, len(df)), total=len(df))
+    finally:
+        cursor.close()
+    return len(df)
+
+
+def copy_rows_to_postgres(rows, table_name: str, columns: list, conn, chunksize: int = 100000):
+    """
+    Write an iterable of row tuples to an existing Postgres table with COPY FROM STDIN, one
+    csv batch of chunksize rows at a time, so memory holds a single batch whatever the number
+    of rows. None is written as NULL, other values as their str().
+    """
+    columns_sql = ", ".join(f'"{column}"' for column in columns)
+    copy_sql = f'COPY "{table_name}" ({columns_sql}) FROM STDIN WITH (FORMAT csv)'
+    rows = iter(rows)
+    n_rows = 0
+    cursor = conn.connection.cursor()
+    try:
+        while True:
+            batch = list(itertools.islice(rows, chunksize))
+            if not batch:
+                break
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            count_round_trips()
+            n_rows += len(batch)
+            report_progress(n_rows)
+    finally:
+        cursor.close()
+    return n_rows
+
+
+def relation_kind(conn, name: str):
+    """
+    pg_class relkind of a relation: 'r' table, 'p' partitioned table, 'm' materialized view,
+    'v' view, or None if there is none of that name
+    """
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name);"), {"name": f'"{name}"'}).scalar()
+
+
+def relation_columns(conn, name: str) -> list:
+    """
+    Column names of a table or materialized view (information_schema leaves the views out)
+    """
+    return conn.execute(
+        text("SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:name) AND attnum > 0 AND NOT attisdropped ORDER BY attnum;"),
+        {"name": f'"{name}"'},
+    ).scalars().all()
+
+
+def drop_relation(conn, name: str):
+    """
+    Drop the table or materialized view of that name, if any: the warehouse backend that
+    created it may have changed since
+    """
+    kind = "MATERIALIZED VIEW" if relation_kind(conn, name) == "m" else "TABLE"
+    conn.execute(text(f'DROP {kind} IF EXISTS "{name}";'))
+
+
+def swap_staging_tables(conn, table_names: list, staging_suffix: str = "_staging", lock_timeout: str = "5s"):
+    """
+    Replace each table with its staging copy in the caller's transaction, so readers keep
+    seeing the previous tables until the whole set is committed. Indexes named after the
+    staging table are renamed after the final table.
+    A short lock_timeout makes the swap fail (and roll back) instead of queueing behind
+    long running reads and blocking every reader that arrives after it.
+    """
+    conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}';"))
+    for table_name in table_names:
+        drop_relation(conn, table_name)
+        conn.execute(text(f'ALTER TABLE "{table_name}{staging_suffix}" RENAME TO "{table_name}";'))
+        index_names = conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table_name;"), {"table_name": table_name}
+        ).scalars().all()
+        for index_name in index_names:
+            if index_name.startswith(f"{table_name}{staging_suffix}"):
+                new_index_name = table_name + index_name[len(f"{table_name}{staging_suffix}"):]
+                conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{new_index_name}";'))
@@ -0,0 +1,119 @@
+"""
+Shared settings and database engine for the pipeline modules and the Streamlit pages.
+Settings come from the secrets.toml files st.secrets reads (.streamlit/secrets.toml of the
+project over ~/.streamlit/secrets.toml) or from environment variables, so importing the
+pipeline does not import Streamlit.
+The engine is created on first use and shared by every module of the process.
+"""
+import os
+import threading
+from sqlalchemy import create_engine
+
+
+secrets_path = os.environ.get(
+    "SECRETS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+)
+global_secrets_path = os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml")
+# Prefix of the upper-case environment variables of the settings not named postgres_*, so that
+# generic variables of the host (PAGE_SIZE, POOL_SIZE, ...) are not picked up
+env_prefix = "AUSTIN_CRIME_"
+
+
+def load_secrets(path: str = secrets_path) -> dict:
+    """
+    Read secrets.toml, or return no settings if there isn't one (e.g. settings given as env vars)
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        import tomllib
+        with open(path, "rb") as file:
+            return tomllib.load(file)
+    except ModuleNotFoundError:  # python < 3.11: the toml package ships with streamlit
+        import toml
+        return toml.load(path)
+
+
+secrets = {**load_secrets(global_secrets_path), **load_secrets()}  # the project file wins, as in st.secrets
+
+
+def env_name(name: str) -> str:
+    """
+    Upper-case environment variable of a setting: POSTGRES_HOST, AUSTIN_CRIME_PAGE_SIZE, ...
+    """
+    return name.upper() if name.startswith("postgres_") else f"{env_prefix}{name.upper()}"
+
+
+def get_setting(name: str, default=None):
+    """
+    Environment variable (as named in secrets.toml, or env_name), then secrets.toml, then default
+    """
+    return os.environ.get(name, os.environ.get(env_name(name), secrets.get(name, default)))
+
+
+# Loads environmental vars from secrets.toml
+
+postgres_host = get_setting("postgres_host")
+postgres_database = get_setting("postgres_database")
+postgres_user = get_setting("postgres_user")
+postgres_password = get_setting("postgres_password")
+postgres_port = get_setting("postgres_port")
+dest_folder = get_setting("dest_folder")
+api_url = get_setting("api_url")
+dataset_id = get_setting("dataset_id")
+table_id = get_setting("table_id")
+destination_path = f"{dest_folder}/{dataset_id}.json"
+raw_cache_path = f"{dest_folder}/{dataset_id}_parquet"
+download_manifest_path = f"{destination_path}.manifest"
+progress_path = f"{dest_folder}/{table_id}_progress.jsonl"
+raw_table_id = f"{table_id}_raw"
+changes_table_id = f"{raw_table_id}_changes"
+state_table_id = f"{table_id}_state"
+version_table_id = f"{table_id}_version"
+pipeline_runs_table_id = f"{table_id}_pipeline_runs"
+stage_metrics_table_id = f"{table_id}_stage_metrics"
+
+# Pipeline modes
+page_size = int(get_setting("page_size", 50000))
+max_retries = int(get_setting("max_retries", 5))
+retry_backoff = float(get_setting("retry_backoff", 1.0))  # seconds before the first retry, doubled each time
+extract_mode = get_setting("extract_mode", "full")  # 'full' or 'incremental'
+extract_engine = get_setting("extract_engine", "sync")  # 'sync' or 'async'
+concurrency = int(get_setting("concurrency", 4))  # pages fetched at a time by the async engine
+requests_per_second = float(get_setting("requests_per_second", 5))  # 0 disables the rate limit
+raw_write_mode = get_setting("raw_write_mode", "merge")  # 'merge' (write only new, changed and deleted rows) or 'replace'
+raw_load_engine = get_setting("raw_load_engine", "pandas")  # 'pandas' or 'stream' (full loads only)
+watermark_column = get_setting("watermark_column", "rep_date_time")  # or ':updated_at'
+transform_engine = get_setting("transform_engine", "pandas")  # 'pandas', 'sql' or 'chunked'
+chunk_size = int(get_setting("chunk_size", 100000))
+aggregate_mode = get_setting("aggregate_mode", "full")  # 'full' or 'incremental'
+warehouse_backend = get_setting("warehouse_backend", "tables")  # 'tables' or 'materialized_views'
+partition_detailed_table = str(get_setting("partition_detailed_table", "false")).lower() == "true"
+
+# Connection pool
+pool_size = int(get_setting("pool_size", 5))
+max_overflow = int(get_setting("max_overflow", 5))
+pool_recycle = int(get_setting("pool_recycle", 1800))  # seconds, the VM drops idle connections
+statement_timeout = int(get_setting("statement_timeout", 0))  # milliseconds, 0 disables it
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Get the shared pooled engine, creating it on first use
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}',
+                    pool_size=pool_size,
+                    max_overflow=max_overflow,
+                    pool_pre_ping=True,
+                    pool_recycle=pool_recycle,
+                    connect_args={"options": f"-c statement_timeout={statement_timeout}"},
+                )
+    return _engine
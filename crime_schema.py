@@ -0,0 +1,140 @@
+"""
+Declared schema of the Austin crime dataset, shared by the extract, transform and load steps.
+Low-cardinality text fields are pandas Categoricals and dates are parsed with their explicit
+ISO format, so frames stay compact and no format inference is needed.
+"""
+import math
+from datetime import datetime
+import pandas as pd
+
+
+# Source field names that differ from the column names used by the pipeline
+source_columns = {"zip_code": "zipcode"}
+
+# Column: (pandas dtype, Postgres type), in the order of the raw table
+raw_schema = {
+    "incident_report_number": ("Int64", "BIGINT"),
+    "address": ("object", "TEXT"),
+    "census_tract": ("category", "TEXT"),
+    "clearance_date": ("datetime64[ns]", "TIMESTAMP"),
+    "clearance_status": ("category", "TEXT"),
+    "council_district": ("category", "TEXT"),
+    "category_description": ("category", "TEXT"),
+    "district": ("category", "TEXT"),
+    "location_type": ("category", "TEXT"),
+    "crime_type": ("category", "TEXT"),
+    "family_violence": ("category", "TEXT"),
+    "occ_date": ("datetime64[ns]", "TIMESTAMP"),
+    "rep_date_time": ("datetime64[ns]", "TIMESTAMP"),
+    "latitude": ("float64", "DOUBLE PRECISION"),
+    "longitude": ("float64", "DOUBLE PRECISION"),
+    "year": ("Int16", "INTEGER"),
+    "zipcode": ("category", "TEXT"),
+}
+
+# Names used after cleaning in create_base_df
+renamed_columns = {"occ_date": "occurred_date", "rep_date_time": "reported_time"}
+
+# Socrata floating timestamps, e.g. 2003-02-10T12:07:00.000
+date_format = "%Y-%m-%dT%H:%M:%S.%f"
+
+raw_columns = list(raw_schema)
+raw_column_types = {column: postgres_type for column, (_, postgres_type) in raw_schema.items()}
+
+
+def parse_dates(series):
+    """
+    Parse a date column in one vectorized pass with the explicit ISO format
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, format=date_format, errors="coerce")
+
+
+def apply_schema(df, renamed: bool = False):
+    """
+    Cast the columns of a dataframe to the declared dtypes; columns not in the schema are kept
+    as they are. Set renamed if the date columns already have their cleaned names.
+    """
+    schema = {
+        (renamed_columns.get(column, column) if renamed else column): dtypes
+        for column, dtypes in raw_schema.items()
+    }
+    df = df.copy()
+    for column, (dtype, _) in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            df[column] = parse_dates(df[column])
+        elif dtype in ("Int64", "Int16", "float64"):
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+        elif dtype == "category":
+            df[column] = df[column].astype("category")
+    return df
+
+
+def row_hashes(df):
+    """
+    Content hash of each row over the raw columns, as signed 64-bit integers (a Postgres BIGINT).
+    Columns are hashed by value, not by dtype, so a record hashes the same whether it was parsed
+    from json or read back from the Parquet cache or the raw table.
+    """
+    canonical = {}
+    for column, (dtype, _) in raw_schema.items():
+        values = df[column]
+        if dtype.startswith("datetime64"):
+            canonical[column] = parse_dates(values).to_numpy(dtype="datetime64[ns]").view("int64")
+        elif dtype in ("Int64", "Int16", "float64"):
+            canonical[column] = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=float("nan"))
+        else:
+            # categorical with object categories: each distinct value is hashed once, and the
+            # hashes equal those of the plain values
+            values = values.astype("category")
+            canonical[column] = pd.Categorical.from_codes(values.cat.codes, values.cat.categories.astype("object"))
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False)
+    return hashes.to_numpy().view("int64")
+
+
+def to_integer(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+
+def to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def to_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_text(value):
+    return None if value is None else str(value)
+
+
+def record_converter(dtype: str):
+    """
+    Convert one json value to the Python value of a column of the given dtype, with the same
+    coercion as apply_schema: values that do not parse become None
+    """
+    if dtype.startswith("datetime64"):
+        return to_timestamp
+    if dtype in ("Int64", "Int16"):
+        return to_integer
+    if dtype == "float64":
+        return to_float
+    return to_text
+
+
+# Converters of the raw columns, for records streamed without a dataframe
+raw_converters = {column: record_converter(dtype) for column, (dtype, _) in raw_schema.items()}
@@ -0,0 +1,112 @@
+"""
+Cached read layer for the Streamlit pages. Tables are cached per pipeline-run version, so widget
+interactions reuse the cached data and a new pipeline run invalidates it automatically.
+"""
+import streamlit as st
+from read_data_from_postgres import (
+    read_counts,
+    read_distinct_values,
+    read_latest_records,
+    read_page,
+    read_pipeline_version,
+    read_stage_metrics,
+    read_summary_tables_from_postgres,
+    read_table,
+)
+
+
+# How often the pages look for a new pipeline run (one small query); every other rerun costs none
+version_check_seconds = 30
+
+
+@st.cache_data(ttl=version_check_seconds, show_spinner=False)
+def get_pipeline_version():
+    return read_pipeline_version()
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading tables...")
+def load_summary_tables(table_id: str, version: int):
+    """
+    The version argument is only part of the cache key: a new run is a cache miss
+    """
+    return read_summary_tables_from_postgres(table_id)
+
+
+def get_summary_tables(table_id: str):
+    """
+    The geo grid, per hour, per year and top crimes tables of the current pipeline run
+    """
+    return load_summary_tables(table_id, get_pipeline_version())
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_counts(table_id: str, column: str, filters: tuple, top_n: int, version: int):
+    return read_counts(table_id, column, dict(filters), top_n)
+
+
+def get_counts(table_id: str, column: str, filters: dict = None, top_n: int = None):
+    """
+    Cached read_counts: each filter combination is queried once per pipeline run
+    """
+    return load_counts(table_id, column, tuple(sorted((filters or {}).items())), top_n, get_pipeline_version())
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def load_distinct_values(table_id: str, column: str, version: int):
+    return read_distinct_values(table_id, column)
+
+
+def get_distinct_values(table_id: str, column: str):
+    return load_distinct_values(table_id, column, get_pipeline_version())
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_page(table_name: str, key_columns: tuple, page_size: int, after: tuple, filters: tuple, version: int):
+    return read_page(table_name, list(key_columns), page_size, after, dict(filters))
+
+
+def get_page(table_name: str, key_columns: list, page_size: int = 50, after: tuple = None, filters: dict = None):
+    """
+    Cached read_page of the current pipeline run
+    """
+    return load_page(table_name, tuple(key_columns), page_size, after, tuple((filters or {}).items()), get_pipeline_version())
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def load_table(table_name: str, version: int):
+    return read_table(table_name)
+
+
+def get_table(table_name: str):
+    return load_table(table_name, get_pipeline_version())
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def load_latest_records(table_id: str, n: int, version: int):
+    return read_latest_records(table_id, n)
+
+
+def get_latest_records(table_id: str, n: int = 5):
+    return load_latest_records(table_id, n, get_pipeline_version())
+
+
+@st.cache_data(ttl=version_check_seconds, show_spinner=False)
+def get_stage_metrics(n_runs: int = 30):
+    """
+    Metrics of the last pipeline runs, also those that did not load a new version
+    """
+    return read_stage_metrics(n_runs)
+
+
+def clear_dashboard_cache():
+    """
+    Forget the cached version and tables, e.g. right after running the pipeline or deleting tables
+    """
+    get_pipeline_version.clear()
+    load_summary_tables.clear()
+    load_counts.clear()
+    load_distinct_values.clear()
+    load_page.clear()
+    load_table.clear()
+    load_latest_records.clear()
+    get_stage_metrics.clear()
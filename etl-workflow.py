@@ -1,6 +1,18 @@
+import sys
+import time
 from prefect import task, flow, get_run_logger
-from extract_json_to_postgres import write_json_to_postgres_main
-from load_dfs_to_postgres import create_dfs_to_postgres_main
+from prefect.task_runners import ConcurrentTaskRunner
+from extract_json_to_postgres import write_cache_to_postgres_main, write_json_to_postgres_main
+from load_dfs_to_postgres import (
+    create_base_df_measured,
+    create_dfs_to_postgres_main,
+    derived_tables,
+    swap_tables_into_place,
+    uses_pandas_engine,
+    write_derived_table,
+    write_detailed_table,
+)
+from pipeline_metrics import finish_run, start_run
 
 
 @task
@@ -12,6 +24,15 @@ def extract_json_to_postgres_task():
     return logger_msg1, logger_msg2
 
 
+@task
+def load_cache_to_postgres_task():
+    logger = get_run_logger()
+    logger_msg1, logger_msg2 = write_cache_to_postgres_main()
+    logger.info(logger_msg1)
+    logger.info(logger_msg2)
+    return logger_msg1, logger_msg2
+
+
 
 @task
 def load_dfs_to_postgres_task():
@@ -20,16 +41,85 @@ def load_dfs_to_postgres_task():
     logger.info(logger_msg)
     return logger_msg
 
-@flow
-def etl_workflow():
+
+@task
+def create_base_df_task():
+    logger = get_run_logger()
+    main_df, logger_msg = create_base_df_measured()
+    logger.info(logger_msg)
+    return main_df, logger_msg
+
+
+@task
+def write_table_task(name: str, main_df):
+    """
+    Write the detailed table (name None) or one derived table to staging, timed
+    """
     logger = get_run_logger()
-    _, msg2 = extract_json_to_postgres_task()
+    start = time.perf_counter()
+    tablenames = write_detailed_table(main_df) if name is None else write_derived_table(name, main_df)
+    seconds = time.perf_counter() - start
+    logger.info(f"Staging table(s) {', '.join(tablenames)} written in {seconds:.2f}s")
+    return tablenames, seconds
+
+
+@task
+def swap_tables_task(tablenames: list, logger_msg: str):
+    logger = get_run_logger()
+    logger_msg = swap_tables_into_place(tablenames, logger_msg)
+    logger.info(logger_msg)
+    return logger_msg
+
+
+def load_tables_in_parallel():
+    """
+    Pandas engine as a task graph: the raw table is read and cleaned once, then the detailed
+    table and each derived table are written by concurrent tasks sharing that frame (threads,
+    so it is neither copied nor reloaded), and the swap waits for all of them
+    """
+    logger = get_run_logger()
+    main_df, logger_msg = create_base_df_task()
+    if "successfully" not in logger_msg:
+        return logger_msg
+    start = time.perf_counter()
+    futures = [write_table_task.submit(name, main_df) for name in [None] + list(derived_tables)]
+    results = [future.result(raise_on_failure=False) for future in futures]
+    wall_seconds = time.perf_counter() - start
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        return f"Error writing staging tables to postgresql due to: {errors[0]}"
+    task_seconds = [seconds for _, seconds in results]
+    logger.info(f"Staging tables written in {wall_seconds:.2f}s: {sum(task_seconds):.2f}s of tasks one after "
+                f"another, {max(task_seconds):.2f}s for the longest (critical path)")
+    return swap_tables_task([name for tablenames, _ in results for name in tablenames], logger_msg)
+
+
+@flow(task_runner=ConcurrentTaskRunner())
+def etl_workflow(from_cache: bool = False):
+    logger = get_run_logger()
+    logger.info(f"Pipeline run {start_run()} started")
+    if from_cache:
+        _, msg2 = load_cache_to_postgres_task()
+    else:
+        _, msg2 = extract_json_to_postgres_task()
     if "success" in msg2:
-        load_dfs_to_postgres_task()
-        logger.info ("Finished creating final transformed tables")
+        if uses_pandas_engine():
+            logger_msg = load_tables_in_parallel()
+        else:
+            logger_msg = load_dfs_to_postgres_task()
+        if "Error" in logger_msg:
+            logger.info ("Pipeline terminated due to error")
+            finish_run("failed")
+        else:
+            logger.info ("Finished creating final transformed tables")
+            finish_run("succeeded")
+    elif "up to date" in msg2:
+        logger.info ("Source data not modified since the last run: final tables are up to date")
+        finish_run("not modified")
     else:
         logger.info ("Pipeline terminated due to error")
+        finish_run("failed")
 
 
 if __name__ == "__main__":
-    etl_workflow()
\ No newline at end of file
+    etl_workflow(from_cache="--from-cache" in sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Async extract engine: fetches several pages of the Socrata API at a time with httpx, within
+a concurrency limit and a rate limit, and hands them in order to the download writer.
+The event loop runs in a background thread, so the next pages are fetched while the
+writer is busy with the previous ones.
+"""
+import asyncio
+import math
+import queue
+import threading
+import time
+from collections import deque
+import httpx
+from extract_json_to_postgres import conditional_headers, page_params, page_result, retry_status_codes
+from progress_events import emit
+from config import concurrency, requests_per_second, max_retries, retry_backoff
+
+
+class RateLimiter:
+    """
+    Spaces the starts of the requests at least 1 / requests_per_second apart
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def get_with_retries_async(client, rate_limiter, api_url: str, params: dict, headers: dict = None,
+                                 max_retries: int = max_retries, backoff: float = retry_backoff):
+    """
+    Async get_with_retries: every attempt waits for its turn in the rate limit
+    """
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        await rate_limiter.wait()
+        try:
+            response = await client.get(api_url, params=params, headers=headers)
+            if response.status_code not in retry_status_codes:
+                if response.status_code >= 400:  # unlike requests, httpx also raises on 304 Not Modified
+                    response.raise_for_status()
+                return response
+            error = httpx.HTTPStatusError(f"{response.status_code} {response.reason_phrase}", request=response.request, response=response)
+            retry_after = response.headers.get("Retry-After")
+        except httpx.TransportError as e:
+            error = e
+        if attempt == max_retries:
+            raise error
+        await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt)
+
+
+async def count_records(client, rate_limiter, api_url: str, where: str = None) -> int:
+    params = {"$select": "count(*) AS count"}
+    if where:
+        params["$where"] = where
+    response = await get_with_retries_async(client, rate_limiter, api_url, params)
+    return int(response.json()[0]["count"])
+
+
+async def produce_pages(put_page, api_url: str, offset: int, page_size: int, where: str = None, previous_pages: list = (),
+                        concurrency: int = concurrency, requests_per_second: float = requests_per_second):
+    """
+    Fetch the pages from offset on, at most concurrency requests at a time, and put them in order.
+    The pages are counted first; records added since are fetched afterwards, one page at a
+    time, until a short page. Stops early if put_page returns False.
+    """
+    rate_limiter = RateLimiter(requests_per_second)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=60) as client:
+
+        async def fetch(i):
+            previous_page = previous_pages[i] if i < len(previous_pages) else None
+            async with semaphore:
+                response = await get_with_retries_async(
+                    client, rate_limiter, api_url, page_params(offset + i * page_size, page_size, where), conditional_headers(previous_page)
+                )
+            return page_result(response, previous_page)
+
+        count = await count_records(client, rate_limiter, api_url, where)
+        emit("total", "download", rows=count)
+        n_pages = max(1, math.ceil((count - offset) / page_size))
+        window = deque()  # pages fetched ahead of the writer, at most 2 * concurrency
+        next_page = 0
+        try:
+            while True:
+                while len(window) < 2 * concurrency and next_page < n_pages:
+                    window.append((next_page, asyncio.create_task(fetch(next_page))))
+                    next_page += 1
+                i, task = window.popleft()
+                records, validators = await task
+                if not await asyncio.to_thread(put_page, (records, validators)):
+                    return
+                n_records = previous_pages[i]["records"] if records is None else len(records)
+                if not window and next_page == n_pages:
+                    if n_records < page_size:
+                        return
+                    n_pages += 1
+        finally:
+            for _, task in window:
+                task.cancel()
+
+
+def fetch_pages_async(api_url: str, offset: int, page_size: int, where: str = None, previous_pages: list = (),
+                      concurrency: int = concurrency, requests_per_second: float = requests_per_second):
+    """
+    Same pages as fetch_pages of extract_json_to_postgres, fetched concurrently in a background
+    event loop and yielded in order. At most concurrency finished pages wait for the caller.
+    """
+    pages = queue.Queue(maxsize=concurrency)
+    stop = threading.Event()
+    done = object()
+
+    def put_page(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            asyncio.run(produce_pages(put_page, api_url, offset, page_size, where, previous_pages, concurrency, requests_per_second))
+            put_page(done)
+        except Exception as e:
+            put_page(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
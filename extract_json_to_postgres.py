@@ -2,97 +2,633 @@
 NEW: Downloads a json file from Austin Crime website API datapoint. 
 Creates a new table in the Postgres server.
 Reads the file as a dataframe and inserts each record to the Postgres table. 
+With raw_load_engine = 'stream' the file is instead parsed record by record and loaded in
+batches, so memory does not grow with the size of the file.
+In incremental mode only records newer than the last run's high-water mark are downloaded
+and upserted into the raw table.
+The raw records are also kept in a local Parquet cache, which can reload the raw table
+without calling the API.
 """
-from sqlalchemy import create_engine
-import streamlit as st
+from sqlalchemy import inspect, text
 import os
 import pandas as pd
 import requests
 import json
+import hashlib
+import itertools
+import time
+import httpx
+import ijson
+from bulk_load_postgres import copy_df_to_postgres, copy_rows_to_postgres
+from crime_schema import apply_schema, raw_column_types, raw_columns, raw_converters, row_hashes, source_columns, to_timestamp
+from raw_cache import read_raw_cache, upsert_raw_cache, write_raw_cache, write_raw_cache_batches
+from pipeline_metrics import report_progress, stage
+from warehouse_views import drop_materialized_views
+from config import (
+    api_url,
+    dest_folder,
+    destination_path,
+    download_manifest_path,
+    raw_cache_path,
+    raw_table_id,
+    changes_table_id,
+    state_table_id,
+    version_table_id,
+    page_size,
+    max_retries,
+    retry_backoff,
+    extract_mode,
+    extract_engine,
+    raw_write_mode,
+    raw_load_engine,
+    watermark_column,
+    chunk_size,
+    aggregate_mode,
+    warehouse_backend,
+    get_engine,
+)
 
 
-# Loads environmental vars from secrets.toml
+# Columns of the raw table: the projected raw columns and the content hash of each row,
+# compared on reload to write only the rows that changed
+raw_table_column_types = {**raw_column_types, "row_hash": "BIGINT"}
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
+# Transient answers of the API, retried with exponential backoff
+retry_status_codes = {429, 500, 502, 503, 504}
 
-engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
 
-def download_json_file_from_url(api_url: str, dest_folder: str, destination_path: str):
+def get_with_retries(api_url: str, params: dict, headers: dict = None, max_retries: int = max_retries, backoff: float = retry_backoff):
+    """
+    GET a url, retrying connection errors, timeouts and transient status codes with exponential
+    backoff (or the delay asked in a Retry-After header). The last error is raised.
+    """
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            response = requests.get(api_url, params=params, headers=headers, timeout=60)
+            if response.status_code not in retry_status_codes:
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+            retry_after = response.headers.get("Retry-After")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt == max_retries:
+            raise error
+        time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt)
+
+
+def page_params(offset: int, limit: int, where: str = None) -> dict:
+    """
+    Query of one page of records from the Socrata API, ordered by the system ':id' field
+    so that $limit/$offset pagination is stable between requests.
+    An optional SoQL $where filter restricts the pages to new or changed records.
+    """
+    params = {"$limit": limit, "$offset": offset, "$order": ":id"}
+    if where:
+        params["$where"] = where
+    if watermark_column.startswith(":"):
+        params["$select"] = ":*, *"  # system fields such as :updated_at are only returned on request
+    return params
+
+
+def conditional_headers(previous_page: dict = None) -> dict:
+    """
+    Validators of the same page in the previous download, to request it only if modified since
+    """
+    headers = {}
+    if previous_page and previous_page.get("etag"):
+        headers["If-None-Match"] = previous_page["etag"]
+    if previous_page and previous_page.get("last_modified"):
+        headers["If-Modified-Since"] = previous_page["last_modified"]
+    return headers
+
+
+def page_result(response, previous_page: dict = None):
+    """
+    Records of a page response, None if not modified (304), and its ETag/Last-Modified validators
+    """
+    if response.status_code == 304:
+        if previous_page is None:
+            raise ValueError("304 Not Modified for a page requested without validators")
+        return None, {"etag": previous_page.get("etag"), "last_modified": previous_page.get("last_modified")}
+    return response.json(), {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+
+def fetch_page(api_url: str, offset: int, limit: int, where: str = None, previous_page: dict = None):
+    """
+    Fetch one page of records. With the manifest entry of the same page in the previous
+    download, the request is conditional: the records are None if the page has not been
+    modified since. Returns the records and the ETag/Last-Modified validators of the page.
+    """
+    response = get_with_retries(api_url, page_params(offset, limit, where), conditional_headers(previous_page))
+    return page_result(response, previous_page)
+
+
+def fetch_pages(api_url: str, offset: int, page_size: int, where: str = None, previous_pages: list = ()):
+    """
+    Fetch the pages from offset on one after another, until the caller stops at a short page.
+    previous_pages are the manifest entries of the same pages in the previous download.
+    """
+    for i in itertools.count():
+        previous_page = previous_pages[i] if i < len(previous_pages) else None
+        yield fetch_page(api_url, offset + i * page_size, page_size, where, previous_page)
+
+
+def read_download_manifest(path: str = download_manifest_path):
+    """
+    Read the manifest of the last download, or None if there isn't one
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_download_manifest(manifest: dict, path: str = download_manifest_path):
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+def page_hashes(manifest: dict) -> list:
+    return [page["sha256"] for page in manifest["pages"]]
+
+
+def mark_download_loaded():
+    """
+    Record the pages of the last download as loaded, once the raw load has committed
+    """
+    manifest = read_download_manifest()
+    write_download_manifest({**manifest, "loaded": page_hashes(manifest)})
+
+
+def download_loaded() -> bool:
+    """
+    Whether every page of the last complete download was loaded into the raw table. A download
+    whose load failed is loaded on the next run, even if the pages are not modified by then.
+    """
+    manifest = read_download_manifest()
+    return manifest is not None and manifest["complete"] and manifest.get("loaded") == page_hashes(manifest)
+
+
+def download_json_file_from_url(api_url: str, dest_folder: str, destination_path: str, page_size: int = page_size, where: str = None,
+                                fetch_pages=fetch_pages):
     """
     Download Austin crime dataset from API endpoint: https://data.austintexas.gov/resource/fdj4-gpfu.json
-    Save data to postgresql database.
+    The dataset is walked page by page with $limit/$offset and each page is appended to a
+    single json array on disk as soon as it arrives, so only one page is held in memory.
+    A manifest records the validators, byte range and hash of every page written:
+    - an interrupted download resumes after its last completed page
+    - pages of a repeated query are requested conditionally, and a page not modified is copied
+      from the previous file
+    - when every page is identical to the previous download, the previous file is kept and the
+      message says the json file is not modified
+    - the hashes of the pages last loaded into the raw table are carried over (see download_loaded)
+    fetch_pages yields the (records, validators) of the pages in order: fetch_pages here, or
+    fetch_pages_async of extract_async to fetch several pages at a time.
     """
 
     if not os.path.exists(str(dest_folder)):
         os.makedirs(str(dest_folder))  # create folder if it does not exist
 
+    query = {"api_url": api_url, "page_size": page_size, "where": where}
+    tmp_path = f"{destination_path}.part"
+    manifest = read_download_manifest()
+    same_query = manifest is not None and manifest["query"] == query
+    loaded = manifest.get("loaded") if same_query else None
+    if same_query and not manifest["complete"] and os.path.exists(tmp_path):
+        previous, pages = manifest["previous"], manifest["pages"]
+    else:
+        previous = manifest["pages"] if same_query and manifest["complete"] else None
+        pages = []
+    if not os.path.exists(destination_path):
+        previous = None
+    offset = sum(page["records"] for page in pages)
+
     try:
-        data = requests.get(api_url)
-        json_file = data.json()
-        with open(destination_path, "w") as file:
-            json.dump(json_file, file)
-        logger_msg = f"json file downloaded successfully to the working directory {dest_folder}"
-    
-    except Exception as e:
-        logger_msg = f"Error while downloading the json file due to: {e}. Check if website is unavailable:https://data.austintexas.gov/ and try later."
+        with open(tmp_path, "r+b" if pages else "wb") as file, open(destination_path if previous else os.devnull, "rb") as previous_file:
+            if pages:
+                file.truncate(pages[-1]["end"])  # drop a page interrupted while being written
+                file.seek(pages[-1]["end"])
+            else:
+                file.write(b"[")
+            previous_pages = previous[len(pages):] if previous else []
+            for records, validators in fetch_pages(api_url, offset, page_size, where, previous_pages):
+                previous_page = previous[len(pages)] if previous and len(pages) < len(previous) else None
+                if records is None:
+                    previous_file.seek(previous_page["start"])
+                    content = previous_file.read(previous_page["end"] - previous_page["start"])
+                    n_records = previous_page["records"]
+                else:
+                    content = ", ".join(json.dumps(record) for record in records).encode()
+                    n_records = len(records)
+                if offset > 0 and n_records > 0:
+                    file.write(b", ")
+                start = file.tell()
+                file.write(content)
+                pages.append({
+                    "offset": offset, "records": n_records, "start": start, "end": file.tell(),
+                    "sha256": hashlib.sha256(content).hexdigest(), **validators,
+                })
+                offset += n_records
+                file.flush()
+                write_download_manifest({"query": query, "complete": False, "pages": pages, "previous": previous, "loaded": loaded})
+                report_progress(offset)
+                if n_records < page_size:
+                    break
+            file.write(b"]")
+        not_modified = previous is not None and [page["sha256"] for page in pages] == [page["sha256"] for page in previous]
+        if not_modified:
+            os.remove(tmp_path)  # same bytes as the file already in place
+        else:
+            os.replace(tmp_path, destination_path)
+        write_download_manifest({"query": query, "complete": True, "pages": pages, "previous": None, "loaded": loaded})
+        if not_modified:
+            logger_msg = f"json file not modified since the last download in {dest_folder} ({offset} records)"
+        else:
+            logger_msg = f"json file downloaded successfully to the working directory {dest_folder} ({offset} records)"
+
+    except (requests.RequestException, httpx.HTTPError, OSError, ValueError) as e:  # ValueError: a body that is not json
+        logger_msg = (f"Error while downloading the json file due to: {e}. {len(pages)} pages were saved and the next run "
+                      f"resumes from record {offset}. Check if website is unavailable:https://data.austintexas.gov/ and try later.")
 
     return logger_msg
 
+def project_raw_columns(df_aux):
+    """
+    Keep the columns used by the pipeline, one row per incident_report_number, typed with the
+    declared schema. Records whose incident_report_number is missing or does not parse are
+    rejected: they cannot be told apart, merged or upserted.
+    """
+    df = apply_schema(df_aux.rename(columns=source_columns).reindex(columns=raw_columns))
+    df = df[df["incident_report_number"].notna()]
+    df = df.drop_duplicates(subset="incident_report_number", keep="last")
+    return df
+
+
+def get_high_water_mark(df_aux):
+    """
+    Get the latest value of the watermark column in the downloaded records, formatted as a
+    Socrata floating timestamp
+    """
+    if watermark_column not in df_aux.columns:
+        return None
+    high_water_mark = pd.to_datetime(df_aux[watermark_column]).max()
+    if pd.isnull(high_water_mark):
+        return None
+    return high_water_mark.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+
+
+def read_high_water_mark(engine):
+    """
+    Read the watermark saved by the last successful run, or None if there isn't one yet
+    """
+    if not inspect(engine).has_table(state_table_id) or not inspect(engine).has_table(raw_table_id):
+        return None
+    with engine.connect() as conn:
+        row = conn.execute(
+            text(f'SELECT high_water_mark FROM "{state_table_id}" WHERE watermark_column = :column;'),
+            {"column": watermark_column},
+        ).fetchone()
+    return row[0] if row else None
+
+
+def write_high_water_mark(engine, high_water_mark: str):
+    """
+    Save the watermark of a successful run in the state table
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{state_table_id}" '
+            "(watermark_column TEXT PRIMARY KEY, high_water_mark TEXT NOT NULL, updated_at TIMESTAMP DEFAULT now());"
+        ))
+        conn.execute(
+            text(
+                f'INSERT INTO "{state_table_id}" (watermark_column, high_water_mark) VALUES (:column, :value) '
+                "ON CONFLICT (watermark_column) DO UPDATE SET high_water_mark = EXCLUDED.high_water_mark, updated_at = now();"
+            ),
+            {"column": watermark_column, "value": high_water_mark},
+        )
+
+
+def create_raw_table_key(conn):
+    """
+    Unique index on incident_report_number, needed to upsert into the raw table, and NOT NULL,
+    which the primary key of the detailed table relies on. Rows without a key left by a load
+    that did not reject them are deleted first.
+    """
+    conn.execute(text(f'DELETE FROM "{raw_table_id}" WHERE incident_report_number IS NULL;'))
+    conn.execute(text(f'ALTER TABLE "{raw_table_id}" ALTER COLUMN incident_report_number SET NOT NULL;'))
+    conn.execute(text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS "{raw_table_id}_incident_report_number_key" '
+        f'ON "{raw_table_id}" (incident_report_number);'
+    ))
+
+
+def record_raw_changes(conn, delta_table: str):
+    """
+    Append the change set of an upsert to the changes table read by the incremental
+    aggregation: the raw rows about to be superseded with sign -1, the incoming rows with sign +1.
+    Must run before the upsert itself.
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    raw_columns_prefixed = ", ".join(f'raw."{column}"' for column in raw_columns)
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{changes_table_id}" AS '
+        f'SELECT 1 AS sign, {columns} FROM "{raw_table_id}" WITH NO DATA;'
+    ))
+    conn.execute(text(
+        f'INSERT INTO "{changes_table_id}" (sign, {columns}) '
+        f'SELECT -1, {raw_columns_prefixed} FROM "{raw_table_id}" AS raw '
+        f'JOIN "{delta_table}" AS delta USING (incident_report_number);'
+    ))
+    conn.execute(text(
+        f'INSERT INTO "{changes_table_id}" (sign, {columns}) SELECT 1, {columns} FROM "{delta_table}";'
+    ))
+
+
+def add_row_hash_column(conn):
+    """
+    Add the row_hash column to a raw table written without it (e.g. by the stream engine); the
+    rows without a hash are rewritten by the next merge or upsert
+    """
+    conn.execute(text(f'ALTER TABLE "{raw_table_id}" ADD COLUMN IF NOT EXISTS row_hash BIGINT;'))
+
+
+def upsert_delta(conn, delta_table: str) -> int:
+    """
+    Insert the rows of delta_table into the raw table, updating the stored rows of the same
+    incident_report_number whose row hash differs; unchanged rows are not rewritten.
+    Returns the number of rows inserted or updated.
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_table_column_types)
+    updates = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in list(raw_table_column_types)[1:])
+    result = conn.execute(text(
+        f'INSERT INTO "{raw_table_id}" ({columns}) SELECT {columns} FROM "{delta_table}" '
+        f"ON CONFLICT (incident_report_number) DO UPDATE SET {updates} "
+        f'WHERE "{raw_table_id}".row_hash IS DISTINCT FROM EXCLUDED.row_hash;'
+    ))
+    return result.rowcount
+
+
+def empty_raw_table(conn) -> bool:
+    """
+    Prepare a full reload of the raw table. The materialized views backend defines its views on
+    the raw table, so there an existing one is emptied and kept; otherwise views left by that
+    backend are dropped, so the table can be replaced. Returns True if the table was kept.
+    """
+    if warehouse_backend == "materialized_views" and inspect(conn).has_table(raw_table_id):
+        add_row_hash_column(conn)
+        conn.execute(text(f'TRUNCATE "{raw_table_id}";'))
+        return True
+    drop_materialized_views(conn)
+    return False
+
+
+def replace_raw_table(df):
+    """
+    Write the projected raw records to the raw Postgres table, replacing the previous one
+    """
+    with get_engine().begin() as conn:
+        if_exists = 'append' if empty_raw_table(conn) else 'replace'
+        copy_df_to_postgres(df.assign(row_hash=row_hashes(df)), raw_table_id, conn, if_exists=if_exists, column_types=raw_table_column_types)
+        create_raw_table_key(conn)
+        # a full reload invalidates the change set, the next transform recomputes every aggregate
+        conn.execute(text(f'DROP TABLE IF EXISTS "{changes_table_id}";'))
+
+
+def merge_raw_table(df):
+    """
+    Bring the raw table in line with a full extract by writing only what differs. The row hashes
+    of the extract are copied to a temporary table and joined with the stored ones; only new and
+    changed rows are then copied and upserted, and rows no longer in the extract are deleted, so
+    unchanged rows cost no writes and no index updates. In incremental aggregate mode the
+    differences are recorded in the change set.
+    Returns the number of rows written and deleted.
+    """
+    df = df.assign(row_hash=row_hashes(df))
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    raw_columns_prefixed = ", ".join(f'raw."{column}"' for column in raw_columns)
+    with get_engine().begin() as conn:
+        add_row_hash_column(conn)
+        create_raw_table_key(conn)
+        conn.execute(text(f'CREATE TEMP TABLE "{raw_table_id}_hashes" (incident_report_number BIGINT, row_hash BIGINT) ON COMMIT DROP;'))
+        copy_df_to_postgres(df[["incident_report_number", "row_hash"]], f'{raw_table_id}_hashes', conn, if_exists='append')
+        conn.execute(text(f'ANALYZE "{raw_table_id}_hashes";'))  # temporary tables are not analyzed automatically
+        changed_keys = conn.execute(text(
+            f'SELECT hashes.incident_report_number FROM "{raw_table_id}_hashes" AS hashes '
+            f'LEFT JOIN "{raw_table_id}" AS raw USING (incident_report_number) '
+            "WHERE raw.row_hash IS DISTINCT FROM hashes.row_hash;"
+        )).scalars().all()
+        df_changed = df[df["incident_report_number"].isin(changed_keys)]
+
+        record_changes = aggregate_mode == "incremental" and inspect(conn).has_table(changes_table_id)
+        missing = (
+            f'NOT EXISTS (SELECT 1 FROM "{raw_table_id}_hashes" AS hashes '
+            "WHERE hashes.incident_report_number = raw.incident_report_number)"
+        )
+        if record_changes:
+            conn.execute(text(
+                f'INSERT INTO "{changes_table_id}" (sign, {columns}) '
+                f'SELECT -1, {raw_columns_prefixed} FROM "{raw_table_id}" AS raw WHERE {missing};'
+            ))
+        deleted = conn.execute(text(f'DELETE FROM "{raw_table_id}" AS raw WHERE {missing};')).rowcount
+
+        conn.execute(text(f'CREATE TEMP TABLE "{raw_table_id}_delta" (LIKE "{raw_table_id}") ON COMMIT DROP;'))
+        copy_df_to_postgres(df_changed, f'{raw_table_id}_delta', conn, if_exists='append')
+        if record_changes:
+            record_raw_changes(conn, f'{raw_table_id}_delta')
+        else:
+            # no change set to add to: the next transform recomputes every aggregate
+            conn.execute(text(f'DROP TABLE IF EXISTS "{changes_table_id}";'))
+        written = upsert_delta(conn, f'{raw_table_id}_delta')
+    return written, deleted
+
+
+def write_raw_table(df):
+    """
+    Write the projected raw records of a full extract to the raw table: merged into the stored
+    rows by row hash (raw_write_mode = 'merge'), or replacing the table.
+    Returns the number of rows written or deleted.
+    """
+    if raw_write_mode == "merge" and inspect(get_engine()).has_table(raw_table_id):
+        written, deleted = merge_raw_table(df)
+        return written + deleted
+    replace_raw_table(df)
+    return len(df)
+
+
+def parse_json_file(destination_path: str):
+    """
+    Read the downloaded json file. Returns the records as downloaded and projected on the raw columns.
+    """
+    with stage("parse") as metrics:
+        df_aux = pd.read_json(f"{destination_path}", dtype=False, convert_dates=False)
+        df = project_raw_columns(df_aux)
+        metrics.update(rows_in=len(df_aux), rows_out=len(df), bytes=os.path.getsize(destination_path))
+    return df_aux, df
+
+
 def write_to_postgres(destination_path: str):
     """
-    Create the dataframe and write to Postgres table if it doesn't already exist
-    """
-    df_aux = pd.read_json(f"{destination_path}")
-    df = df_aux.reindex(
-        columns=[
-            "incident_report_number",
-            "address",
-            "census_tract",
-            "clearance_date",
-            "clearance_status",
-            "council_district",
-            "category_description",
-            "district",
-            "location_type",
-            "crime_type",
-            "family_violence",
-            "occ_date",
-            "rep_date_time",
-            "latitude",
-            "longitude",
-            "year",
-            "zipcode",
-        ]
-    )
-    df.to_sql(name = f'{table_id}', con=engine, if_exists='replace', index=False)
+    Create the dataframe and write it to the raw Postgres table, replacing the previous one,
+    and to the local Parquet cache. Returns the high-water mark of the loaded records.
+    """
+    df_aux, df = parse_json_file(destination_path)
+    with stage("raw load") as metrics:
+        metrics.update(rows_in=len(df), rows_out=write_raw_table(df))
+    with stage("raw cache") as metrics:
+        write_raw_cache(df)
+        metrics.update(rows_in=len(df), rows_out=len(df))
+    return get_high_water_mark(df_aux)
+
+
+def iter_raw_rows(file, watermark: dict):
+    """
+    Parse the downloaded json array record by record and yield each one as a tuple of the raw
+    columns, typed as apply_schema would, numbered in file order. The number of records read
+    and the latest watermark value are kept in watermark as a side result.
+    """
+    source_names = {column: source for source, column in source_columns.items()}
+    fields = [(source_names.get(column, column), raw_converters[column]) for column in raw_columns]
+    for ordinal, record in enumerate(ijson.items(file, "item")):
+        watermark["records"] = ordinal + 1
+        value = to_timestamp(record.get(watermark_column))
+        if value is not None and (watermark["high_water_mark"] is None or value > watermark["high_water_mark"]):
+            watermark["high_water_mark"] = value
+        yield (ordinal, *(convert(record.get(field)) for field, convert in fields))
+
+
+def read_raw_table_batches(conn, chunksize: int = chunk_size):
+    """
+    Read the raw table back as typed dataframes of chunksize rows, with a server-side cursor
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    for df in pd.read_sql_query(
+        text(f'SELECT {columns} FROM "{raw_table_id}";'), conn.execution_options(stream_results=True), chunksize=chunksize
+    ):
+        yield apply_schema(df)
+
+
+def stream_to_postgres(destination_path: str):
+    """
+    Same result as write_to_postgres without building a dataframe of the whole file: records
+    are parsed one by one and copied in batches to a temporary table, and the last version of
+    each incident_report_number is kept in the raw table by Postgres (records without one are
+    rejected, as in project_raw_columns). The Parquet cache is then written from the raw table,
+    batch by batch. Returns the high-water mark of the loaded records.
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    columns_ddl = ", ".join(f'"{column}" {raw_column_types[column]}' for column in raw_columns)
+    watermark = {"records": 0, "high_water_mark": None}
+    with stage("raw load") as metrics, get_engine().begin() as conn:
+        if not empty_raw_table(conn):
+            conn.execute(text(f'DROP TABLE IF EXISTS "{raw_table_id}";'))
+            conn.execute(text(f'CREATE TABLE "{raw_table_id}" ({columns_ddl});'))
+        conn.execute(text(f'CREATE TEMP TABLE "{raw_table_id}_stream" (ordinal BIGINT, {columns_ddl}) ON COMMIT DROP;'))
+        with open(destination_path, "rb") as file:
+            rows = iter_raw_rows(file, watermark)
+            copy_rows_to_postgres(rows, f"{raw_table_id}_stream", ["ordinal"] + raw_columns, conn, chunksize=chunk_size)
+        result = conn.execute(text(
+            f'INSERT INTO "{raw_table_id}" ({columns}) SELECT DISTINCT ON (incident_report_number) {columns} '
+            f'FROM "{raw_table_id}_stream" WHERE incident_report_number IS NOT NULL ORDER BY incident_report_number, ordinal DESC;'
+        ))
+        create_raw_table_key(conn)
+        # a full reload invalidates the change set, the next transform recomputes every aggregate
+        conn.execute(text(f'DROP TABLE IF EXISTS "{changes_table_id}";'))
+        metrics.update(rows_in=watermark["records"], rows_out=result.rowcount, bytes=os.path.getsize(destination_path))
+    with stage("raw cache") as metrics, get_engine().connect() as conn:
+        write_raw_cache_batches(read_raw_table_batches(conn))
+        metrics.update(rows_in=result.rowcount, rows_out=result.rowcount)
+    high_water_mark = watermark["high_water_mark"]
+    return high_water_mark.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] if high_water_mark else None
+
+
+def upsert_to_postgres(destination_path: str):
+    """
+    Insert new records and update changed ones in the raw Postgres table, keyed on
+    incident_report_number. The downloaded delta goes through a temporary table with the
+    same column types as the raw table.
+    Returns the high-water mark of the loaded records and the number of upserted rows.
+    """
+    df_aux, df = parse_json_file(destination_path)
+    if df_aux.empty:
+        return None, 0
+    with stage("raw load") as metrics, get_engine().begin() as conn:
+        add_row_hash_column(conn)
+        create_raw_table_key(conn)
+        conn.execute(text(f'CREATE TEMP TABLE "{raw_table_id}_delta" (LIKE "{raw_table_id}") ON COMMIT DROP;'))
+        copy_df_to_postgres(df.assign(row_hash=row_hashes(df)), f'{raw_table_id}_delta', conn, if_exists='append')
+        if aggregate_mode == "incremental":
+            record_raw_changes(conn, f'{raw_table_id}_delta')
+        metrics.update(rows_in=len(df), rows_out=upsert_delta(conn, f'{raw_table_id}_delta'))
+    with stage("raw cache") as metrics:
+        upsert_raw_cache(df)
+        metrics.update(rows_in=len(df), rows_out=len(df))
+    return get_high_water_mark(df_aux), len(df)
+
+
+def write_cache_to_postgres_main():
+    """
+    Load the raw table from the local Parquet cache instead of the API (--from-cache),
+    so the transform can run with no network access
+    """
+    if not os.path.exists(raw_cache_path):
+        logger_msg1 = f"Error reading the local cache: {raw_cache_path} does not exist. Run the pipeline once without --from-cache."
+        return logger_msg1, f"Error creating table '{raw_table_id}' in postgreSQL"
+    with stage("parse") as metrics:
+        df = read_raw_cache()
+        metrics.update(rows_out=len(df))
+    logger_msg1 = f"Raw records read successfully from the local cache {raw_cache_path} ({len(df)} records)"
+    with stage("raw load") as metrics:
+        metrics.update(rows_in=len(df), rows_out=write_raw_table(df))
+    high_water_mark = get_high_water_mark(df)
+    if high_water_mark:
+        write_high_water_mark(get_engine(), high_water_mark)
+    logger_msg2 = f"Table '{raw_table_id}' created in postgreSQL with success (from the local cache)"
+    return logger_msg1, logger_msg2
 
 
 def write_json_to_postgres_main():
-    logger_msg1 = download_json_file_from_url(api_url, dest_folder, destination_path)
-    if "successfully" in logger_msg1:
-        write_to_postgres(destination_path)
-        logger_msg2 = f"Table '{table_id}' created in postgreSQL with success"
+    high_water_mark = read_high_water_mark(get_engine()) if extract_mode == "incremental" else None
+    if extract_engine == "async":
+        from extract_async import fetch_pages_async as page_fetcher  # extract_async imports this module
+    else:
+        page_fetcher = fetch_pages
+    with stage("download") as metrics:
+        if high_water_mark:
+            # >= instead of > so records sharing the last timestamp are not lost; the upsert dedups them
+            where = f"{watermark_column} >= '{high_water_mark}'"
+            logger_msg1 = download_json_file_from_url(api_url, dest_folder, destination_path, where=where, fetch_pages=page_fetcher)
+        else:
+            logger_msg1 = download_json_file_from_url(api_url, dest_folder, destination_path, fetch_pages=page_fetcher)
+        manifest = read_download_manifest()
+        if manifest and manifest["complete"]:
+            metrics.update(rows_out=sum(page["records"] for page in manifest["pages"]), bytes=os.path.getsize(destination_path))
+    if "not modified" in logger_msg1 and download_loaded() and inspect(get_engine()).has_table(raw_table_id) and inspect(get_engine()).has_table(version_table_id):
+        logger_msg2 = f"Table '{raw_table_id}' is up to date: nothing to load"
+    elif "successfully" in logger_msg1 or "not modified" in logger_msg1:
+        if high_water_mark:
+            new_high_water_mark, n_rows = upsert_to_postgres(destination_path)
+            logger_msg2 = f"Table '{raw_table_id}' created in postgreSQL with success ({n_rows} records upserted since {high_water_mark})"
+        else:
+            load = stream_to_postgres if raw_load_engine == "stream" else write_to_postgres
+            new_high_water_mark = load(destination_path)
+            logger_msg2 = f"Table '{raw_table_id}' created in postgreSQL with success"
+        if new_high_water_mark:
+            write_high_water_mark(get_engine(), new_high_water_mark)
+        mark_download_loaded()
     else:
-        logger_msg2 = f"Error creating table '{table_id}' in postgreSQL"
+        logger_msg2 = f"Error creating table '{raw_table_id}' in postgreSQL"
     return logger_msg1, logger_msg2
     
 
 
 if __name__ == "__main__":
-    logger_msg1 = download_json_file_from_url(api_url, dest_folder, destination_path)
+    logger_msg1, logger_msg2 = write_json_to_postgres_main()
     print (logger_msg1)
-    if "successfully" in logger_msg1:
-        write_to_postgres(destination_path)
-        logger_msg2 = f"{table_id} created in postgreSQL with success"
-        print (logger_msg2)
+    print (logger_msg2)
     
 
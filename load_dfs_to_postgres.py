@@ -1,57 +1,274 @@
 """
 Reads the Postgres table as a dataframe and creates 4 separate dataframes from main table. 
 """
-import streamlit as st
-from sqlalchemy import create_engine
 import pandas as pd
+from sqlalchemy import text
+from bulk_load_postgres import copy_df_to_postgres, swap_staging_tables
 from transform_create_dfs import (
     create_base_df,
     create_df_geo,
+    create_geo_grid,
+    combine_geo_grids,
+    create_crime_cube,
+    combine_crime_cubes,
     create_crimes_per_hour,
     create_crimes_per_year,
     top_crimes,
+    read_base_df_chunks,
+    combine_counts,
+    top_crimes_from_counts,
 )
+from crime_schema import raw_column_types, renamed_columns
+from transform_sql import create_tables_in_sql
+from transform_incremental import apply_changes, can_apply_changes, clear_changes, create_crime_type_counts
+from warehouse_ddl import create_table_ddl
+from warehouse_views import create_materialized_views, refresh_materialized_views
+from pipeline_metrics import report_progress, stage
+from config import table_id, raw_table_id, version_table_id, transform_engine, chunk_size, aggregate_mode, warehouse_backend, get_engine
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
 
-engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
+def write_pipeline_version(conn):
+    """
+    Increment the pipeline-run version read by the dashboard cache
+    """
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{version_table_id}" (id INTEGER PRIMARY KEY, version BIGINT NOT NULL, loaded_at TIMESTAMP NOT NULL);'
+    ))
+    conn.execute(text(
+        f'INSERT INTO "{version_table_id}" (id, version, loaded_at) VALUES (1, 1, now()) '
+        f'ON CONFLICT (id) DO UPDATE SET version = "{version_table_id}".version + 1, loaded_at = now();'
+    ))
+
+
+def swap_tables_into_place(tablenames: list, logger_msg: str, refresh_views: bool = False):
+    """
+    Build the keys and indexes of the loaded staging tables, then swap them into place in one
+    transaction, together with a new pipeline-run version. In incremental aggregation mode the
+    full crime type counts are swapped in too, and the change set they already include is cleared.
+    With refresh_views the materialized views are created or refreshed in that same transaction,
+    so readers see the new views, tables and version at once.
+    """
+    try:
+        with stage("indexes"), get_engine().begin() as conn:
+            create_table_ddl(conn, tablenames)
+    except Exception as e:
+        return f"Error creating indexes on staging tables in postgresql due to: {e}"
+    try:
+        with get_engine().begin() as conn:
+            if refresh_views:
+                with stage("refresh views") as metrics:
+                    created = create_materialized_views(conn)
+                    refreshed = refresh_materialized_views(conn, skip=created)
+                    metrics.update(rows_out=len(created) + len(refreshed))
+            with stage("swap"):
+                if aggregate_mode == "incremental":
+                    if f"{table_id}_crime_type_counts" not in tablenames:
+                        tablenames = tablenames + [create_crime_type_counts(conn)]
+                    clear_changes(conn)
+                swap_staging_tables(conn, tablenames)
+                write_pipeline_version(conn)
+    except Exception as e:
+        action = "refreshing materialized views and swapping staging tables" if refresh_views else "swapping staging tables"
+        logger_msg = f"Error {action} into place in postgresql due to: {e}"
+    return logger_msg
+
+
+def check_raw_table():
+    """
+    Check the raw table written by the extract step can be read
+    """
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text(f'SELECT 1 FROM "{raw_table_id}" LIMIT 1;'))
+        logger_msg = f"Table {raw_table_id} loaded successfully from postgresql"
+    except Exception as e:
+        logger_msg = f"Error reading table {raw_table_id} from postgresql due to: {e}"
+    return logger_msg
+
+
+def create_sql_tables_to_postgres():
+    """
+    Build the output tables with the SQL engine inside Postgres, then swap them into place
+    """
+    logger_msg = check_raw_table()
+    if "successfully" in logger_msg:
+        with stage("transform"), get_engine().begin() as conn:
+            tablenames = create_tables_in_sql(conn)
+        logger_msg = swap_tables_into_place(tablenames, logger_msg)
+    return logger_msg
+
+
+def create_view_tables_to_postgres():
+    """
+    Materialized view backend: the detailed table is built with the SQL engine, and the derived
+    tables are materialized views of the raw table, defined on the first run and refreshed
+    concurrently on the next ones, all inside Postgres without blocking readers. The refresh
+    commits together with the swap of the detailed table and the new pipeline-run version.
+    """
+    logger_msg = check_raw_table()
+    if "successfully" in logger_msg:
+        with stage("transform"), get_engine().begin() as conn:
+            tablenames = create_tables_in_sql(conn, only=[""])
+        logger_msg = swap_tables_into_place(tablenames, logger_msg, refresh_views=True)
+    return logger_msg
+
+
+def create_incremental_tables_to_postgres():
+    """
+    Apply the change set of the last incremental extract to the stored aggregates. The detailed
+    and geo tables are rebuilt with the SQL engine.
+    """
+    logger_msg = check_raw_table()
+    if "successfully" in logger_msg:
+        with stage("transform"), get_engine().begin() as conn:
+            tablenames = create_tables_in_sql(conn, only=["", "_geo", "_geo_grid"])
+            tablenames += apply_changes(conn)
+        logger_msg = swap_tables_into_place(tablenames, logger_msg)
+    return logger_msg
+
+
+def create_chunked_tables_to_postgres():
+    """
+    Out-of-core transform: clean the raw table and filter the geo table chunk by chunk, and merge
+    the partial hour/year/crime type counts of every chunk. Peak memory is bounded by chunk_size.
+    """
+    logger_msg = check_raw_table()
+    if "successfully" in logger_msg:
+        detailed_column_types = {renamed_columns.get(column, column): column_type for column, column_type in raw_column_types.items()}
+        hour_dfs, year_dfs, crime_type_counts = [], [], []
+        with stage("transform") as metrics, get_engine().begin() as conn:
+            for i, chunk in enumerate(read_base_df_chunks(get_engine(), chunk_size)):
+                if_exists = 'replace' if i == 0 else 'append'
+                copy_df_to_postgres(chunk, f'{table_id}_staging', conn, if_exists=if_exists, column_types=detailed_column_types, index=True)
+                df_geo = create_df_geo(chunk)
+                copy_df_to_postgres(df_geo, f'{table_id}_geo_staging', conn, if_exists=if_exists, column_types=detailed_column_types, index=True)
+                # the partial grid and cube can have as many rows as the chunk: folded into running totals
+                grid = create_geo_grid(df_geo)
+                df_geo_grid = combine_geo_grids([grid] if i == 0 else [df_geo_grid, grid])
+                hour_dfs.append(create_crimes_per_hour(chunk))
+                year_dfs.append(create_crimes_per_year(chunk))
+                crime_type_counts.append(chunk["crime_type"].astype("object").value_counts())
+                cube = create_crime_cube(chunk)
+                df_crime_cube = combine_crime_cubes([cube] if i == 0 else [df_crime_cube, cube])
+                metrics["rows_in"] = (metrics["rows_in"] or 0) + len(chunk)
+                report_progress(metrics["rows_in"])
+            if not hour_dfs:
+                return f"Error reading table {raw_table_id} from postgresql due to: table is empty"
+
+            df_crimes_per_hour = combine_counts(hour_dfs, "hour")
+            df_crimes_per_year = combine_counts(year_dfs, "year")
+            df_top_crimes = top_crimes_from_counts(pd.concat(crime_type_counts).groupby(level=0).sum())
+            copy_df_to_postgres(df_crimes_per_hour, f'{table_id}_crimes_per_hour_staging', conn, index=True)
+            copy_df_to_postgres(df_crimes_per_year, f'{table_id}_crimes_per_year_staging', conn, index=True)
+            copy_df_to_postgres(df_top_crimes, f'{table_id}_top_crimes_staging', conn, index=True)
+            copy_df_to_postgres(df_geo_grid, f'{table_id}_geo_grid_staging', conn)
+            copy_df_to_postgres(df_crime_cube, f'{table_id}_crime_cube_staging', conn)
+
+        tablenames = [f'{table_id}', f'{table_id}_geo', f'{table_id}_geo_grid', f'{table_id}_crimes_per_hour', f'{table_id}_crimes_per_year', f'{table_id}_top_crimes', f'{table_id}_crime_cube']
+        logger_msg = swap_tables_into_place(tablenames, logger_msg)
+    return logger_msg
+
+
+def create_geo_tables(main_df):
+    df_geo = create_df_geo(main_df)
+    return {f'{table_id}_geo': (df_geo, True), f'{table_id}_geo_grid': (create_geo_grid(df_geo), False)}
+
+
+def create_crimes_per_hour_table(main_df):
+    return {f'{table_id}_crimes_per_hour': (create_crimes_per_hour(main_df), True)}
+
+
+def create_crimes_per_year_table(main_df):
+    return {f'{table_id}_crimes_per_year': (create_crimes_per_year(main_df), True)}
+
+
+def create_top_crimes_table(main_df):
+    return {f'{table_id}_top_crimes': (top_crimes(main_df), True)}
+
+
+def create_crime_cube_table(main_df):
+    return {f'{table_id}_crime_cube': (create_crime_cube(main_df), False)}
+
+
+# Derived tables of the pandas engine: name: function of the cleaned frame returning
+# {table name: (dataframe, write its index)}. Each one only reads the shared frame.
+derived_tables = {
+    "geo": create_geo_tables,
+    "crimes_per_hour": create_crimes_per_hour_table,
+    "crimes_per_year": create_crimes_per_year_table,
+    "top_crimes": create_top_crimes_table,
+    "crime_cube": create_crime_cube_table,
+}
+
+
+def write_detailed_table(main_df):
+    """
+    Write the cleaned frame to the detailed staging table. Returns the final table names.
+    """
+    with stage("write detailed") as metrics, get_engine().begin() as conn:
+        copy_df_to_postgres(main_df, f'{table_id}_staging', conn, index=True)
+        metrics.update(rows_in=len(main_df), rows_out=len(main_df))
+    return [f'{table_id}']
+
+
+def write_derived_table(name: str, main_df):
+    """
+    Compute one derived table from the cleaned frame and write it to its staging table in its
+    own transaction, so the derived tables can be written concurrently. The staging tables are
+    only visible to readers once swap_tables_into_place commits. Returns the final table names.
+    """
+    with stage(f"write {name}") as metrics, get_engine().begin() as conn:
+        output_dfs = derived_tables[name](main_df)
+        for table_name, (df, index) in output_dfs.items():
+            copy_df_to_postgres(df, f'{table_name}_staging', conn, index=index)
+        metrics.update(rows_in=len(main_df), rows_out=sum(len(df) for df, _ in output_dfs.values()))
+    return list(output_dfs)
+
+
+def create_base_df_measured():
+    """
+    create_base_df as the transform stage of the pipeline metrics
+    """
+    with stage("transform") as metrics:
+        main_df, logger_msg = create_base_df(get_engine())
+        metrics.update(rows_out=len(main_df))
+    return main_df, logger_msg
+
+
+def uses_pandas_engine():
+    """
+    Whether create_dfs_to_postgres_main builds the tables with pandas (the only engine split in
+    one task per derived table by the flow)
+    """
+    if warehouse_backend == "materialized_views":
+        return False
+    if aggregate_mode == "incremental" and can_apply_changes(get_engine()):
+        return False
+    return transform_engine not in ("sql", "chunked")
+
 
 def create_dfs_to_postgres_main():
-    
+    if warehouse_backend == "materialized_views":
+        return create_view_tables_to_postgres()
+    if aggregate_mode == "incremental" and can_apply_changes(get_engine()):
+        return create_incremental_tables_to_postgres()
+    if transform_engine == "sql":
+        return create_sql_tables_to_postgres()
+    if transform_engine == "chunked":
+        return create_chunked_tables_to_postgres()
+
     main_df = pd.DataFrame([])
-    main_df, logger_msg = create_base_df(engine)
+    main_df, logger_msg = create_base_df_measured()
     if "successfully" in logger_msg:
-        df_geo = create_df_geo(main_df)
-        df_crimes_per_hour = create_crimes_per_hour(main_df)
-        df_crimes_per_year = create_crimes_per_year(main_df)
-        df_top_crimes = top_crimes(main_df)
-
-        main_df.to_sql(name = f'{table_id}', con=engine, if_exists='replace')
-        df_geo.to_sql(name = f'{table_id}_geo', con=engine, if_exists='replace')
-        df_crimes_per_hour.to_sql(name = f'{table_id}_crimes_per_hour', con=engine, if_exists='replace')
-        df_crimes_per_year.to_sql(name = f'{table_id}_crimes_per_year', con=engine, if_exists='replace')
-        df_top_crimes.to_sql(name = f'{table_id}_top_crimes', con=engine, if_exists='replace')
+        # Write every output to a staging table first, then swap them all into place at once
+        tablenames = write_detailed_table(main_df)
+        for name in derived_tables:
+            tablenames += write_derived_table(name, main_df)
+        logger_msg = swap_tables_into_place(tablenames, logger_msg)
 
     return logger_msg
 
 if __name__ == "__main__":
 
-    main_df = create_base_df(engine)
-    df_geo = create_df_geo(main_df)
-    df_crimes_per_hour = create_crimes_per_hour(main_df)
-    df_crimes_per_year = create_crimes_per_year(main_df)
-    df_top_crimes = top_crimes(main_df)
-
-    df_geo.to_sql(name = f'{table_id}_geo', con=engine, if_exists='replace')
-    df_crimes_per_hour.to_sql(name = f'{table_id}_crimes_per_hour', con=engine, if_exists='replace')
-    df_crimes_per_year.to_sql(name = f'{table_id}_crimes_per_year', con=engine, if_exists='replace')
-    df_top_crimes.to_sql(name = f'{table_id}_top_crimes', con=engine, if_exists='replace')
+    logger_msg = create_dfs_to_postgres_main()
+    print (logger_msg)
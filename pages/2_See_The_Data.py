@@ -1,7 +1,10 @@
 import streamlit as st
 import os
-from sqlalchemy import create_engine, text
-from read_data_from_postgres import read_all_tables_from_postgres
+import shutil
+from sqlalchemy import text
+from config import dataset_id, table_id, destination_path, raw_cache_path, get_engine
+from dashboard_data import get_distinct_values, get_latest_records, get_page, get_table, clear_dashboard_cache
+from warehouse_views import drop_materialized_views
 
 st.set_page_config(page_title='ETL Pipeline' ,layout="wide",page_icon='🔁')
 
@@ -31,22 +34,32 @@ def card(wch_colour_box, wch_colour_font, sline, i, iconname=None):
                             margin-top: 0;'>{sline}</style></span></p>"""
       return lnk + htmlstr
 
+
+def browse_table(table_name, key_columns, filter_columns=(), page_size=50):
+      """Shows a large table one page at a time, with keyset pagination, filtered in Postgres"""
+      filters = {}
+      for column, col_filter in zip(filter_columns, st.columns(max(len(filter_columns), 1))):
+            values = [None] + get_distinct_values(table_id, column)
+            filters[column] = col_filter.selectbox(column.replace("_", " ").capitalize(), values, format_func=lambda x: "All" if x is None else x, key=f"filter_{table_name}_{column}")
+      if st.session_state.get(f"filters_{table_name}") != filters:  # new filters start from the first page
+            st.session_state[f"filters_{table_name}"] = filters
+            st.session_state[f"cursors_{table_name}"] = [None]
+      cursors = st.session_state.setdefault(f"cursors_{table_name}", [None])
+      df_page = get_page(table_name, key_columns, page_size, cursors[-1], filters)
+      st.dataframe(df_page)
+      col_previous, col_page, col_next = st.columns([1,2,1])
+      col_page.write(f"Page {len(cursors)}")
+      if col_previous.button("Previous page", disabled=len(cursors) == 1, key=f"previous_{table_name}"):
+            cursors.pop()
+            st.rerun()
+      if col_next.button("Next page", disabled=len(df_page) < page_size, key=f"next_{table_name}"):
+            cursors.append(tuple(df_page.iloc[-1][key_columns]))
+            st.rerun()
+
 # Loads environmental vars from secrets.toml
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
 finished_workflow = st.secrets.finished_workflow
 
-engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
-
 # Building app
 st.title("ETL Pipeline - Austin Crime Database 👮‍♂️")
 
@@ -75,9 +88,7 @@ with st.container(border=True):
 if finished_workflow == 'true':
 
     col1, col2 = st.columns([3,1])
-    df_crimes, df_geo, df_hour, df_year, df_top_crimes = read_all_tables_from_postgres(table_id)
-    five_records = df_crimes.sort_values(by='occurred_date', ascending=False).head()
-    f = os.listdir("./data/")
+    f = [name for name in os.listdir("./data/") if name.endswith(".json")]  # not the Parquet cache folder
     labels = [f"Detailed table {table_id}", f"Table {table_id}_geo", f"Table {table_id}_crimes_by_hour",f"Table {table_id}_crimes_by_year", f"Table {table_id}_top_crimes", "5 latest records"]
     if len(f) == 0:
         del_labels = ["None", "SQL tables (all)"]
@@ -92,11 +103,20 @@ if finished_workflow == 'true':
             st.write("📂 *data* folder:")
             st.write(filename)
 
-        options_dict_dfs = {'Detailed': df_crimes, '_geo': df_geo, '_hour': df_hour, '_year': df_year, '_top': df_top_crimes, 'latest records': five_records}
         option2 = st.selectbox("Choose a table:", labels)
-        for key in options_dict_dfs.keys():
-            if key in option2:
-                st.dataframe(options_dict_dfs[key])
+        # Large tables are browsed page by page, small ones are shown whole
+        if 'Detailed' in option2:
+            browse_table(table_id, ["occurred_date", "incident_report_number"], ["year", "district", "crime_type"])
+        elif '_geo' in option2:
+            browse_table(f"{table_id}_geo", ["incident_report_number"], ["district", "crime_type"])
+        elif '_hour' in option2:
+            st.dataframe(get_table(f"{table_id}_crimes_per_hour"))
+        elif '_year' in option2:
+            st.dataframe(get_table(f"{table_id}_crimes_per_year"))
+        elif '_top' in option2:
+            st.dataframe(get_table(f"{table_id}_top_crimes"))
+        elif 'latest records' in option2:
+            st.dataframe(get_latest_records(table_id, 5))
     
     with col2:
         with st.container():
@@ -104,16 +124,20 @@ if finished_workflow == 'true':
             if st.button ("Delete"):
                 if os.path.exists(destination_path) and option1 == f"File {f[0]}":
                     os.remove (destination_path)
+                    shutil.rmtree(raw_cache_path, ignore_errors=True)
                 elif option1 == 'None':
                     st.write('Nothing to delete')
                 else:
-                    tablenames = [f"{table_id}", f"{table_id}_geo", f"{table_id}_crimes_per_hour",f"{table_id}_crimes_per_year", f"{table_id}_top_crimes"]
+                    tablenames = [f"{table_id}_raw", f"{table_id}_raw_changes", f"{table_id}_state", f"{table_id}_version", f"{table_id}_crime_type_counts", f"{table_id}", f"{table_id}_geo", f"{table_id}_geo_grid", f"{table_id}_crimes_per_hour",f"{table_id}_crimes_per_year", f"{table_id}_top_crimes", f"{table_id}_crime_cube"]
+                    with get_engine().begin() as conn:
+                        drop_materialized_views(conn)  # they depend on the raw table
                     for name in tablenames:
                         sqlquery = f'DROP TABLE IF EXISTS "{name}";'
-                        with engine.connect() as conn:
+                        with get_engine().connect() as conn:
                             conn.execute(text(sqlquery))
                             conn.commit()
                             st.secrets.finished_workflow = 'false'
+                clear_dashboard_cache()
                 st.rerun()
 
 elif finished_workflow == 'false':
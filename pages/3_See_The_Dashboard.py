@@ -1,7 +1,7 @@
 import streamlit as st
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
-from read_data_from_postgres import read_all_tables_from_postgres
+from config import table_id
+from dashboard_data import get_counts, get_distinct_values, get_summary_tables
 
 st.set_page_config(page_title='ETL Pipeline' ,layout="wide",page_icon='🔁')
 
@@ -33,16 +33,6 @@ def card(wch_colour_box, wch_colour_font, sline, i, iconname=None):
 
 # Loads environmental vars from secrets.toml
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
 finished_workflow = st.secrets.finished_workflow
 
 # Building app
@@ -51,10 +41,10 @@ st.title("ETL Pipeline - Austin Crime Database 👮‍♂️")
 if finished_workflow == 'false':
     st.info ("There's no data to be seen. Run 'Start Pipeline' button first, in 'See The Pipeline'")
 else:
-    engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
-
-    df_crimes, df_geo, df_hour, df_year, df_top_crimes = read_all_tables_from_postgres(table_id)
-    df_top_crimes = df_top_crimes.sort_values('number_of_crimes', ascending=False)[:10]
+    df_geo_grid, df_hour, df_year, df_top_crimes = get_summary_tables(table_id)
+    df_top_crimes = df_top_crimes.sort_values('number_of_crimes', ascending=False)
+    df_top_crimes_all = df_top_crimes['crime_type'].tolist()
+    df_top_crimes = df_top_crimes[:10]
 
     col1, col2 = st.columns(2)
     fontsize=5
@@ -75,10 +65,15 @@ else:
         st.subheader('Number of Crimes per Year')
         st.bar_chart (df_year, x="year", y="number_of_crimes", color=['#cf3251'])
 
-        df_location = df_crimes[['location_type']].value_counts('location_type', sort=True, ascending=False)[:10]
+        col21, col22 = st.columns(2)
+        with col21:
+            year = st.selectbox("Year", [None] + df_year["year"].tolist(), format_func=lambda x: "All years" if x is None else x)
+        with col22:
+            district = st.selectbox("District", [None] + get_distinct_values(table_id, "district"), format_func=lambda x: "All districts" if x is None else x)
+        df_location = get_counts(table_id, "location_type", {"year": year, "district": district}, top_n=10)
         fig2, ax2 = plt.subplots()  
-        labels = df_location.index.tolist()
-        ax2.pie (df_location.values.tolist())
+        labels = df_location['location_type'].tolist()
+        ax2.pie (df_location['number_of_crimes'].tolist())
         fig2.patch.set_facecolor("#0E1117")
         fig2.legend(labels=labels, fontsize=fontsize)
         st.subheader('Number of Crimes by Location Type (Top10)')
@@ -86,4 +81,15 @@ else:
 
 
     st.subheader('Crime Density Within Austin City')
-    st.map(df_geo)
\ No newline at end of file
+    col31, col32 = st.columns(2)
+    with col31:
+        cell_size = st.select_slider("Map resolution (cell size in degrees)", options=sorted(df_geo_grid["cell_size"].unique(), reverse=True))
+    with col32:
+        crime_type = st.selectbox("Crime type", [None] + df_top_crimes_all, format_func=lambda x: "All crime types" if x is None else x)
+    df_cells = df_geo_grid[df_geo_grid["cell_size"] == cell_size]
+    if crime_type is not None:
+        df_cells = df_cells[df_cells["crime_type"] == crime_type]
+    df_cells = df_cells.groupby(["latitude", "longitude"], as_index=False)["number_of_crimes"].sum()
+    # One circle per cell, its area proportional to the number of crimes, the largest filling the cell
+    df_cells["size"] = cell_size * 111_000 / 2 * (df_cells["number_of_crimes"] / df_cells["number_of_crimes"].max()) ** 0.5
+    st.map(df_cells, latitude="latitude", longitude="longitude", size="size")
\ No newline at end of file
@@ -0,0 +1,70 @@
+import streamlit as st
+from dashboard_data import get_stage_metrics
+
+st.set_page_config(page_title='ETL Pipeline' ,layout="wide",page_icon='🔁')
+
+# Latest run slower than this many times the median of the previous runs, and by more than min_regression_seconds
+regression_ratio = 1.5
+min_regression_seconds = 0.5
+
+# Building app
+st.title("ETL Pipeline - Austin Crime Database 👮‍♂️")
+
+with st.expander ("How to use this app:"):
+    st.markdown (
+    """  **SEE THE METRICS** :  \n  - Every pipeline run records the wall time, rows, bytes, peak memory and database
+    round-trips of each of its stages  \n  - Choose a metric to follow its trend across runs, stage by stage  \n  - Stages of the
+    latest run much slower than usual are listed as possible regressions""")
+
+n_runs = st.slider("Number of runs", min_value=5, max_value=100, value=30, step=5)
+df_metrics = get_stage_metrics(n_runs)
+
+if df_metrics.empty:
+    st.info ("No pipeline run recorded yet. Run 'Start Pipeline' button first, in 'See The Pipeline'")
+else:
+    df_metrics["rows per second"] = df_metrics["rows_out"] / df_metrics["seconds"]
+    df_metrics["MB per second"] = df_metrics["bytes"] / 1e6 / df_metrics["seconds"]
+    metrics = {
+        "Wall time (s)": "seconds",
+        "Throughput (rows/s)": "rows per second",
+        "Throughput (MB/s)": "MB per second",
+        "Peak RSS during the stage (MB)": "peak_rss_mb",
+        "Database round-trips": "round_trips",
+    }
+
+    col1, col2 = st.columns([3,1])
+    with col1:
+        metric = st.selectbox("Metric", list(metrics))
+        st.subheader(f"{metric} per stage across runs")
+        df_trend = df_metrics.pivot_table(index="run_id", columns="stage", values=metrics[metric], aggfunc="sum")
+        st.line_chart(df_trend.dropna(axis=1, how="all"))
+
+    latest_run_id = df_metrics["run_id"].max()
+    df_latest = df_metrics[df_metrics["run_id"] == latest_run_id]
+    with col2:
+        run = df_latest.iloc[0]
+        st.subheader(f"Run {latest_run_id}")
+        st.write(f"{run['run_started_at']:%Y-%m-%d %H:%M} | {run['status']}")
+        st.write(f"Extract: {run['extract_mode']} | Transform: {run['transform_engine']}")
+        st.metric("Total stage time (s)", f"{df_latest['seconds'].sum():.1f}")
+
+    st.subheader("Possible regressions in the latest run")
+    df_previous = df_metrics[(df_metrics["run_id"] < latest_run_id) & (df_metrics["status"] != "running")]
+    df_compare = df_latest.groupby("stage", as_index=False)["seconds"].sum().merge(
+        df_previous.groupby(["run_id", "stage"])["seconds"].sum().groupby("stage").median().rename("median_seconds").reset_index(),
+        on="stage",
+    )
+    df_compare["ratio"] = df_compare["seconds"] / df_compare["median_seconds"]
+    df_regressions = df_compare[
+        (df_compare["ratio"] > regression_ratio) & (df_compare["seconds"] - df_compare["median_seconds"] > min_regression_seconds)
+    ]
+    if df_regressions.empty:
+        st.write("No stage of the latest run is slower than usual")
+    else:
+        st.dataframe(df_regressions.sort_values("ratio", ascending=False), hide_index=True)
+
+    st.subheader("Stages of the latest run")
+    st.dataframe(
+        df_latest[["stage", "seconds", "rows_in", "rows_out", "bytes", "rows per second", "peak_rss_mb", "round_trips"]],
+        hide_index=True,
+    )
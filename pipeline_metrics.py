@@ -0,0 +1,215 @@
+"""
+Per-stage instrumentation of the pipeline: wall time, rows in and out, bytes, peak RSS and
+database round-trips of each stage, saved to the pipeline runs and stage metrics tables read
+by the 'See The Metrics' page. Stage starts and ends, and the progress reported within a
+stage, are also sent to the progress channel.
+"""
+import contextvars
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event, text
+from progress_events import emit, reset_progress
+from config import pipeline_runs_table_id, stage_metrics_table_id, extract_mode, transform_engine, get_engine
+
+
+# Metrics of the stage running in the current thread or task, None outside of a stage
+current_stage = contextvars.ContextVar("current_stage", default=None)
+current_run_id = None
+# Metrics of the stages running in any thread, by id, whose peak RSS is being sampled
+running_stages = {}
+_peak_lock = threading.Lock()
+_sampler = None
+sample_interval = 0.005  # seconds
+_instrumented_engine = None
+_instrument_lock = threading.Lock()
+
+
+def count_round_trips(n: int = 1):
+    """
+    Count database round-trips in the current stage; statements run through SQLAlchemy are
+    counted automatically, raw cursor calls such as COPY call this themselves
+    """
+    metrics = current_stage.get()
+    if metrics is not None:
+        metrics["round_trips"] += n
+
+
+def instrument_engine(engine):
+    """
+    Count every statement the engine executes as a round-trip of the current stage
+    """
+    global _instrumented_engine
+    with _instrument_lock:
+        if _instrumented_engine is not engine:
+            event.listen(engine, "before_cursor_execute", lambda *args: count_round_trips())
+            _instrumented_engine = engine
+
+
+def report_progress(rows: int, total: int = None):
+    """
+    Send the rows done so far in the current stage (and the expected total, if known) to the
+    progress channel, e.g. after each downloaded page or transformed chunk
+    """
+    metrics = current_stage.get()
+    if metrics is not None:
+        emit("progress", metrics["stage"], rows=rows, total=total, seconds=time.perf_counter() - metrics["start"])
+
+
+def peak_rss_megabytes() -> float:
+    """
+    Peak resident memory of the process so far, where /proc/self/status is not available
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3  # bytes on macOS, kB on Linux
+
+
+def memory_status(field: str):
+    """
+    A memory counter of the process in MB, e.g. VmRSS or VmHWM (its peak), None if unavailable
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1e3  # kB to MB
+    except OSError:
+        return None
+
+
+def sample_peak_rss():
+    """
+    Sample the RSS of the process into the peak of every running stage, until none is left
+    """
+    global _sampler
+    while True:
+        rss = memory_status("VmRSS")
+        with _peak_lock:
+            if not running_stages:
+                _sampler = None
+                return
+            for metrics in running_stages.values():
+                metrics["peak_rss_mb"] = max(metrics["peak_rss_mb"], rss)
+        time.sleep(sample_interval)
+
+
+def start_peak_rss(metrics: dict):
+    """
+    Start measuring the peak RSS of a stage. The process peak (VmHWM) is never reset, as the
+    benchmarks measure their own peak with it: the RSS is sampled while the stage runs instead.
+    Returns the process peak at the start of the stage, None without /proc/self/status.
+    """
+    global _sampler
+    metrics["peak_rss_mb"] = memory_status("VmRSS")
+    if metrics["peak_rss_mb"] is None:
+        return None
+    with _peak_lock:
+        running_stages[id(metrics)] = metrics
+        if _sampler is None:
+            _sampler = threading.Thread(target=sample_peak_rss, daemon=True)
+            _sampler.start()
+    return memory_status("VmHWM")
+
+
+def stop_peak_rss(metrics: dict, start_peak: float):
+    """
+    Peak RSS of a stage, in MB: the highest RSS sampled during the stage, or the process peak if
+    the stage raised it. Without /proc/self/status, the process peak since it started.
+    """
+    if start_peak is None:
+        metrics["peak_rss_mb"] = peak_rss_megabytes()
+        return
+    with _peak_lock:
+        running_stages.pop(id(metrics), None)
+    peak = memory_status("VmHWM")
+    metrics["peak_rss_mb"] = max(metrics["peak_rss_mb"], memory_status("VmRSS"), peak if peak > start_peak else 0)
+
+
+def create_metrics_tables(conn):
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{pipeline_runs_table_id}" ('
+        "run_id BIGSERIAL PRIMARY KEY, started_at TIMESTAMP NOT NULL DEFAULT now(), finished_at TIMESTAMP, "
+        "status TEXT NOT NULL DEFAULT 'running', extract_mode TEXT, transform_engine TEXT);"
+    ))
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{stage_metrics_table_id}" ('
+        f'run_id BIGINT NOT NULL REFERENCES "{pipeline_runs_table_id}" (run_id) ON DELETE CASCADE, '
+        "stage TEXT NOT NULL, started_at TIMESTAMP NOT NULL, seconds DOUBLE PRECISION NOT NULL, "
+        "rows_in BIGINT, rows_out BIGINT, bytes BIGINT, peak_rss_mb DOUBLE PRECISION, round_trips INTEGER);"
+    ))
+
+
+def start_run():
+    """
+    Record a new pipeline run; the stages that follow in this process are saved under it
+    """
+    global current_run_id
+    with get_engine().begin() as conn:
+        create_metrics_tables(conn)
+        current_run_id = conn.execute(
+            text(f'INSERT INTO "{pipeline_runs_table_id}" (extract_mode, transform_engine) VALUES (:extract_mode, :transform_engine) RETURNING run_id;'),
+            {"extract_mode": extract_mode, "transform_engine": transform_engine},
+        ).scalar()
+    reset_progress()
+    emit("run_start", run_id=current_run_id)
+    return current_run_id
+
+
+def finish_run(status: str):
+    global current_run_id
+    if current_run_id is None:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(f'UPDATE "{pipeline_runs_table_id}" SET finished_at = now(), status = :status WHERE run_id = :run_id;'),
+            {"status": status, "run_id": current_run_id},
+        )
+    emit("run_end", run_id=current_run_id, status=status)
+    current_run_id = None
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Measure a stage of the pipeline. The block fills in rows_in, rows_out and bytes of the
+    yielded metrics; wall time, peak RSS during the stage and round-trips are measured. The metrics are saved
+    when the block ends if a run was started, and a failed stage is saved too.
+    """
+    instrument_engine(get_engine())
+    start = time.perf_counter()
+    metrics = {"rows_in": None, "rows_out": None, "bytes": None, "round_trips": 0, "stage": name, "start": start}
+    started_at = time.time()
+    token = current_stage.set(metrics)
+    start_peak = start_peak_rss(metrics)
+    emit("stage_start", name)
+    try:
+        yield metrics
+    except BaseException:
+        name = f"{name} (failed)"
+        raise
+    finally:
+        current_stage.reset(token)
+        metrics["seconds"] = time.perf_counter() - start
+        stop_peak_rss(metrics, start_peak)
+        emit("stage_end", name, **{key: metrics[key] for key in ["seconds", "rows_in", "rows_out", "bytes", "peak_rss_mb", "round_trips"]})
+        if current_run_id is not None:
+            save_stage_metrics(name, started_at, metrics)
+
+
+def save_stage_metrics(name: str, started_at: float, metrics: dict):
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(
+                f'INSERT INTO "{stage_metrics_table_id}" '
+                "(run_id, stage, started_at, seconds, rows_in, rows_out, bytes, peak_rss_mb, round_trips) "
+                "VALUES (:run_id, :stage, to_timestamp(:started_at), :seconds, :rows_in, :rows_out, :bytes, :peak_rss_mb, :round_trips);"
+            ),
+            {
+                "run_id": current_run_id, "stage": name, "started_at": started_at,
+                "seconds": metrics["seconds"], "peak_rss_mb": metrics["peak_rss_mb"], "round_trips": metrics["round_trips"],
+                # numpy integers cannot be bound as query parameters
+                **{key: None if metrics[key] is None else int(metrics[key]) for key in ["rows_in", "rows_out", "bytes"]},
+            },
+        )
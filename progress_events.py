@@ -0,0 +1,56 @@
+"""
+Progress channel between the pipeline and the 'See The Pipeline' page: the pipeline appends one
+json object per line to a progress file (run start and end, stage start and end, rows done so
+far), and the page reads the lines added since its last read without waiting on the pipeline.
+"""
+import json
+import os
+import threading
+import time
+from config import progress_path
+
+
+_lock = threading.Lock()
+
+
+def to_json(value):
+    return value.item() if hasattr(value, "item") else str(value)  # numpy scalars, timestamps
+
+
+def emit(event: str, stage: str = None, path: str = progress_path, **fields):
+    """
+    Append an event, e.g. emit("progress", "download", rows=150000, total=300000). Events are
+    only written once reset_progress has started the file of a run: a stage run on its own (or
+    a benchmark, or a test) has no one reading its progress, and maybe no dest_folder yet.
+    """
+    if not os.path.exists(path):
+        return
+    line = json.dumps({"time": time.time(), "event": event, "stage": stage, **fields}, default=to_json)
+    with _lock, open(path, "a") as file:
+        file.write(line + "\n")
+
+
+def reset_progress(path: str = progress_path):
+    """
+    Start an empty progress file for a new run
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _lock, open(path, "w"):
+        pass
+
+
+def read_events(position: int = 0, path: str = progress_path):
+    """
+    Events written since position (a byte offset in the file), and the position to read from
+    next time. An unfinished last line is left for the next read.
+    """
+    if not os.path.exists(path):
+        return [], 0
+    if os.path.getsize(path) < position:  # a new run started a new file
+        position = 0
+    with open(path, "rb") as file:
+        file.seek(position)
+        data = file.read()
+    end = data.rfind(b"\n") + 1
+    events = [json.loads(line) for line in data[:end].splitlines() if line]
+    return events, position + end
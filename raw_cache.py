@@ -0,0 +1,121 @@
+"""
+Local columnar copy of the raw extract: one Parquet file per year of occ_date, written next to
+the downloaded json file. Re-runs and backfills read it memory-mapped, pruned to the columns
+and years they need, instead of re-parsing the whole json array; the pipeline can also load
+the raw table from it without calling the API (--from-cache).
+"""
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from crime_schema import raw_schema, raw_columns
+from config import raw_cache_path
+
+
+partition_column = "occ_year"
+null_partition = "__HIVE_DEFAULT_PARTITION__"  # records without occ_date
+
+arrow_types = {
+    "Int64": pa.int64(),
+    "Int16": pa.int16(),
+    "float64": pa.float64(),
+    "object": pa.string(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "datetime64[ns]": pa.timestamp("ns"),
+}
+
+# Declared once, so every yearly file has the same schema even when a column is empty that year
+arrow_schema = pa.schema([(column, arrow_types[dtype]) for column, (dtype, _) in raw_schema.items()])
+
+
+def partition_path(year, path: str = raw_cache_path) -> str:
+    name = null_partition if pd.isnull(year) else int(year)
+    return os.path.join(path, f"{partition_column}={name}", "part-0.parquet")
+
+
+def write_partitions(df, path: str):
+    """
+    Write one Parquet file per year of occ_date of the projected raw records
+    """
+    years = df["occ_date"].dt.year
+    for year, df_year in df.groupby(years.fillna(-1).astype(int), sort=False):
+        file_path = partition_path(None if year == -1 else year, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        table = pa.Table.from_pandas(df_year[raw_columns], schema=arrow_schema, preserve_index=False)
+        pq.write_table(table, file_path)
+
+
+def write_raw_cache(df, path: str = raw_cache_path):
+    """
+    Replace the cache with the projected raw records. The new cache is written aside and
+    renamed, so an interrupted run leaves the previous cache intact.
+    """
+    write_raw_cache_batches([df], path)
+
+
+def write_raw_cache_batches(batches, path: str = raw_cache_path):
+    """
+    Same as write_raw_cache for records that come as an iterable of dataframes: each batch is
+    appended as row groups to the file of its years, so memory holds one batch at a time
+    """
+    tmp_path = f"{path}.part"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    writers = {}
+    try:
+        for df in batches:
+            years = df["occ_date"].dt.year
+            for year, df_year in df.groupby(years.fillna(-1).astype(int), sort=False):
+                if year not in writers:
+                    file_path = partition_path(None if year == -1 else year, tmp_path)
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    writers[year] = pq.ParquetWriter(file_path, arrow_schema)
+                writers[year].write_table(pa.Table.from_pandas(df_year[raw_columns], schema=arrow_schema, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def read_raw_cache(path: str = raw_cache_path, columns: list = None, years: list = None):
+    """
+    Read the cached raw records, optionally only some columns and some years of occ_date.
+    Files are memory-mapped and only the selected columns and year files are decoded.
+    """
+    filters = [(partition_column, "in", [int(year) for year in years])] if years else None
+    table = pq.read_table(
+        path,
+        columns=columns or raw_columns,
+        filters=filters,
+        memory_map=True,
+        partitioning="hive",
+    )
+    return table.to_pandas()
+
+
+def upsert_raw_cache(df, path: str = raw_cache_path):
+    """
+    Merge upserted raw records into the cache, keyed on incident_report_number. Only the year
+    files holding a new year or a previous version of an upserted record are rewritten.
+    """
+    if not os.path.exists(path):
+        return False
+    keys = read_raw_cache(path, columns=["incident_report_number", partition_column])
+    previous_years = keys.loc[keys["incident_report_number"].isin(df["incident_report_number"]), partition_column]
+    years = set(pd.Series(previous_years, dtype="object").dropna().astype(int))
+    years |= set(df["occ_date"].dt.year.dropna().astype(int))
+    has_null_year = df["occ_date"].isnull().any() or previous_years.isnull().any()
+    existing = [read_raw_cache(path, years=sorted(years))] if years else []
+    if has_null_year and os.path.exists(partition_path(None, path)):
+        existing.append(pq.read_table(partition_path(None, path), schema=arrow_schema).to_pandas())
+    merged = pd.concat(existing + [df[raw_columns]], ignore_index=True)
+    merged = merged.drop_duplicates(subset="incident_report_number", keep="last")
+    for year in years:
+        if os.path.exists(partition_path(year, path)):
+            os.remove(partition_path(year, path))
+    if has_null_year and os.path.exists(partition_path(None, path)):
+        os.remove(partition_path(None, path))
+    write_partitions(merged, path)
+    return True
@@ -1,37 +1,207 @@
+import numpy as np
 import pandas as pd
-import streamlit as st
-from sqlalchemy import create_engine
-
-# Loads environmental vars from secrets.toml
-
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
-finished_workflow = st.secrets.finished_workflow
-
-engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
-
-def read_all_tables_from_postgres(table_id):
-
-    try:
-        sql = f'SELECT * FROM "{table_id}";'
-        df_crime = pd.read_sql_query(sql, con=engine)
-        sql_geo = f'SELECT * FROM "{table_id}_geo";'
-        df_geo = pd.read_sql_query(sql_geo, con=engine)
-        sql_hour = f'SELECT * FROM "{table_id}_crimes_per_hour";'
-        df_hour = pd.read_sql_query(sql_hour, con=engine)
-        sql_year = f'SELECT * FROM "{table_id}_crimes_per_year";'
-        df_year = pd.read_sql_query(sql_year, con=engine)
-        sql_top = f'SELECT * FROM "{table_id}_top_crimes";'
-        df_top = pd.read_sql_query(sql_top, con=engine)
-    except Exception as e:
-        print(f"Error: Tables cannot be read due to: {e}")
-    return df_crime, df_geo, df_hour, df_year, df_top
+from sqlalchemy import inspect, text
+from transform_create_dfs import cube_keys
+from config import version_table_id, pipeline_runs_table_id, stage_metrics_table_id, get_engine
 
+
+def lock_tables(conn, tablenames: list):
+    """
+    Take shared locks on the tables about to be read, so the load step cannot swap them in the
+    middle of the reads. Materialized views cannot be locked and need not be: their refresh
+    rewrites rows, not relations, and is followed by a new pipeline-run version.
+    """
+    tables = conn.execute(
+        text("SELECT relname FROM pg_class WHERE relname = ANY(:names) AND relkind IN ('r', 'p');"), {"names": tablenames}
+    ).scalars().all()
+    if tables:
+        conn.execute(text("LOCK TABLE " + ", ".join(f'"{name}"' for name in tables) + " IN ACCESS SHARE MODE;"))
+
+
+def read_pipeline_version():
+    """
+    Version of the last pipeline run that loaded the warehouse, 0 if there is none
+    """
+    if not inspect(get_engine()).has_table(version_table_id):
+        return 0
+    with get_engine().connect() as conn:
+        version = conn.execute(text(f'SELECT version FROM "{version_table_id}" WHERE id = 1;')).scalar()
+    return version or 0
+
+
+def read_stage_metrics(n_runs: int = 30):
+    """
+    Stage metrics of the last n_runs pipeline runs, oldest first, empty if no run was recorded yet
+    """
+    if not inspect(get_engine()).has_table(stage_metrics_table_id):
+        return pd.DataFrame()
+    sql = f"""
+        SELECT runs.run_id, runs.started_at AS run_started_at, runs.status, runs.extract_mode, runs.transform_engine,
+               stages.stage, stages.seconds, stages.rows_in, stages.rows_out, stages.bytes, stages.peak_rss_mb, stages.round_trips
+        FROM (SELECT * FROM "{pipeline_runs_table_id}" ORDER BY run_id DESC LIMIT :n_runs) AS runs
+        JOIN "{stage_metrics_table_id}" AS stages USING (run_id)
+        ORDER BY runs.run_id, stages.started_at;
+    """
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(text(sql), con=conn, params={"n_runs": n_runs})
+
+
+# Columns of the detailed table the dashboard can filter pages by, as SQL expressions
+query_columns = {
+    "year": "extract(year FROM occurred_date)::int",
+    "hour": "extract(hour FROM reported_time)::int",
+    "district": "district",
+    "council_district": "council_district",
+    "crime_type": "crime_type",
+    "location_type": "location_type",
+}
+
+
+def build_where(filters: dict, conditions: list = None, params: dict = None):
+    """
+    WHERE clause and bound parameters for {column: value} filters on query_columns,
+    added to any conditions and params already built by the caller
+    """
+    conditions, params = list(conditions or []), dict(params or {})
+    for i, (column, value) in enumerate((filters or {}).items()):
+        if column not in query_columns:
+            raise ValueError(f"{column} is not a filter column: {list(query_columns)}")
+        if value is None:
+            continue
+        if column == "year":  # a range on occurred_date can use its index (and prune year partitions)
+            conditions.append(f"occurred_date >= make_date(:value_{i}, 1, 1) AND occurred_date < make_date(:value_{i} + 1, 1, 1)")
+        else:
+            conditions.append(f"{query_columns[column]} = :value_{i}")
+        params[f"value_{i}"] = int(value) if column == "year" else to_python(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def check_cube_dimensions(columns):
+    for column in columns:
+        if column not in cube_keys:
+            raise ValueError(f"{column} is not a dimension of the crime cube: {cube_keys}")
+
+
+def build_cube_where(filters: dict):
+    """
+    WHERE clause and bound parameters for {dimension: value} filters on the crime cube; a list
+    or tuple value matches any of its values
+    """
+    check_cube_dimensions(filters or {})
+    conditions, params = [], {}
+    for i, (column, value) in enumerate((filters or {}).items()):
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            conditions.append(f"{column} = ANY(:value_{i})")
+            value = list(value)
+        else:
+            conditions.append(f"{column} = :value_{i}")
+        params[f"value_{i}"] = value
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def read_cube(table_id: str, group_by: list, filters: dict = None):
+    """
+    Number of crimes per combination of the group_by dimensions, summed over the rows of the
+    crime cube matching the filters, e.g. thefts by hour in district 3 in 2023:
+    read_cube(table_id, ["hour"], {"crime_type": "THEFT", "district": "3", "year": 2023})
+    """
+    check_cube_dimensions(group_by)
+    where, params = build_cube_where(filters)
+    columns = ", ".join(group_by)
+    select = f"{columns}, " if group_by else ""
+    group = f"GROUP BY {columns} ORDER BY {columns}" if group_by else ""
+    sql = f'SELECT {select}sum(number_of_crimes)::bigint AS number_of_crimes FROM "{table_id}_crime_cube" {where} {group};'
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(text(sql), con=conn, params=params)
+
+
+def read_counts(table_id: str, column: str, filters: dict = None, top_n: int = None):
+    """
+    Number of crimes per value of column, summed over the crime cube in Postgres, optionally
+    filtered (e.g. {"year": 2023, "district": "3"}) and limited to the top_n values
+    """
+    check_cube_dimensions([column])
+    where, params = build_cube_where(filters)
+    order = "number_of_crimes DESC" if top_n else column
+    limit = f"LIMIT {int(top_n)}" if top_n else ""
+    sql = f"""
+        SELECT {column}, sum(number_of_crimes)::bigint AS number_of_crimes
+        FROM "{table_id}_crime_cube" {where}
+        GROUP BY 1 HAVING {column} IS NOT NULL
+        ORDER BY {order} {limit};
+    """
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(text(sql), con=conn, params=params)
+
+
+def read_distinct_values(table_id: str, column: str):
+    """
+    Values of column present in the data, to fill the dashboard filters, read from the crime cube
+    """
+    check_cube_dimensions([column])
+    sql = f'SELECT DISTINCT {column} FROM "{table_id}_crime_cube" WHERE {column} IS NOT NULL ORDER BY 1;'
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(text(sql), con=conn)[column].tolist()
+
+
+def read_summary_tables_from_postgres(table_id):
+    """
+    Read the 4 small tables the dashboard draws: the geo grid instead of every geocoded point,
+    and no detailed table
+    """
+    tablenames = [f"{table_id}_geo_grid", f"{table_id}_crimes_per_hour", f"{table_id}_crimes_per_year", f"{table_id}_top_crimes"]
+    with get_engine().begin() as conn:
+        lock_tables(conn, tablenames)
+        return tuple(pd.read_sql_query(f'SELECT * FROM "{name}";', con=conn) for name in tablenames)
+
+
+def to_python(value):
+    """
+    Convert pandas/numpy scalars so they can be bound as query parameters
+    """
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def read_page(table_name: str, key_columns: list, page_size: int = 50, after: tuple = None, filters: dict = None):
+    """
+    Read one page of a table, newest first, with keyset pagination on key_columns: the page
+    starts after the key of the last row of the previous page (after), so Postgres walks the
+    (key_columns) index and reads page_size rows whatever the page number.
+    Rows with a NULL key are not listed. {column: value} filters on query_columns (None for
+    any value) are pushed into the WHERE clause as bound parameters.
+    """
+    keys = ", ".join(f'"{column}"' for column in key_columns)
+    conditions = [f'"{column}" IS NOT NULL' for column in key_columns]
+    params = {"page_size": page_size}
+    if after is not None:
+        conditions.append(f"({keys}) < ({', '.join(f':after_{i}' for i in range(len(key_columns)))})")
+        params.update({f"after_{i}": to_python(value) for i, value in enumerate(after)})
+    where, params = build_where(filters, conditions, params)
+    order = ", ".join(f'"{column}" DESC' for column in key_columns)
+    sql = f'SELECT * FROM "{table_name}" {where} ORDER BY {order} LIMIT :page_size;'
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(text(sql), con=conn, params=params)
+
+
+def read_latest_records(table_id: str, n: int = 5):
+    """
+    The n most recent incidents of the detailed table, read from the top of its
+    (occurred_date, incident_report_number) index instead of sorting the whole table
+    """
+    return read_page(table_id, ["occurred_date", "incident_report_number"], page_size=n)
+
+
+def read_table(table_name: str):
+    """
+    Read a whole (small) table
+    """
+    with get_engine().connect() as conn:
+        return pd.read_sql_query(f'SELECT * FROM "{table_name}";', con=conn)
@@ -0,0 +1,152 @@
+"""
+Shared fixtures of the tests. The settings point at the 'test_austin_crime' table id and a
+temporary folder before any pipeline module imports config, so the tests never touch the
+tables or files of the app. Postgres is the one configured in .streamlit/secrets.toml or the
+POSTGRES_* environment variables; the tests that need it are skipped when it cannot be reached.
+"""
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+test_table_id = "test_austin_crime"
+test_folder = tempfile.mkdtemp()
+# config reads the environment variables named as in secrets.toml before anything else
+os.environ.update({"table_id": test_table_id, "dataset_id": test_table_id, "dest_folder": test_folder})
+os.environ["retry_backoff"] = "0.01"  # seconds
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from config import get_engine
+
+sample_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "austin_crime.json")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(test_folder, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """
+    The shared engine, with every test table dropped at the end of the session
+    """
+    try:
+        engine = get_engine()
+        with engine.connect():
+            pass
+    except Exception as e:  # no settings, or no server
+        pytest.skip(f"Postgres is not available: {e}")
+    yield engine
+    with engine.begin() as conn:
+        for name in conn.execute(text("SELECT matviewname FROM pg_matviews WHERE matviewname LIKE 'test\\_%';")).scalars():
+            conn.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{name}" CASCADE;'))
+        for name in conn.execute(text("SELECT tablename FROM pg_tables WHERE tablename LIKE 'test\\_%';")).scalars():
+            conn.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE;'))
+
+
+@pytest.fixture
+def sample_records():
+    """
+    Raw records of data/austin_crime.json, projected and typed as the extract step does
+    """
+    from extract_json_to_postgres import project_raw_columns
+    return project_raw_columns(pd.read_json(sample_path, dtype=False, convert_dates=False))
+
+
+class SocrataStub:
+    """
+    Local stand-in of the Socrata API: $limit/$offset pages of records, $select=count(*), an
+    ETag on every page (304 Not Modified when If-None-Match matches it), and injected latency
+    and failures. failures maps a page offset to the answers given before the page, one per
+    request: a status code, a body answered with 200 OK, or None to close the connection
+    without answering.
+    """
+
+    def __init__(self, records: list, latency=0.0):
+        self.records = records
+        self.latency = latency  # seconds, or a function of the page offset
+        self.failures = {}
+        self.requests = []  # offset of every page request, in arrival order
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}/resource/stub.json"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def handler(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status: int, content: bytes = b"", headers: dict = None):
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", "Content-Length": str(len(content)), **(headers or {})}.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+                if params.get("$select", "").startswith("count"):
+                    return self.send(200, json.dumps([{"count": str(len(stub.records))}]).encode())
+                offset, limit = int(params["$offset"]), int(params["$limit"])
+                with stub.lock:
+                    stub.requests.append(offset)
+                    failures = stub.failures.get(offset)
+                    failure = failures.pop(0) if failures else False
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency(offset) if callable(stub.latency) else stub.latency)
+                    if failure is None:
+                        self.close_connection = True
+                        return
+                    if isinstance(failure, bytes):
+                        return self.send(200, failure)
+                    if failure:
+                        return self.send(failure)
+                    content = json.dumps(stub.records[offset:offset + limit]).encode()
+                    etag = f'"{hashlib.sha256(content).hexdigest()}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        with stub.lock:
+                            stub.not_modified += 1
+                        return self.send(304, headers={"ETag": etag})
+                    self.send(200, content, {"ETag": etag})
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def socrata_stub():
+    """
+    Start a SocrataStub: socrata_stub(records, latency=0.0)
+    """
+    stubs = []
+
+    def start(records: list, latency=0.0):
+        stubs.append(SocrataStub(records, latency))
+        return stubs[-1]
+
+    yield start
+    for stub in stubs:
+        stub.close()
@@ -0,0 +1,44 @@
+"""
+The chunked engine against the pandas reference implementation, with chunks much smaller
+than the fixture raw table
+"""
+import pandas as pd
+import pytest
+import load_dfs_to_postgres
+from extract_json_to_postgres import replace_raw_table
+from transform_create_dfs import create_base_df, create_crime_cube, create_df_geo, create_geo_grid
+from config import table_id
+
+
+@pytest.fixture
+def chunked_tables(engine, sample_records, monkeypatch):
+    """
+    Pandas reference tables of the sample records, and the tables of the chunked engine
+    """
+    replace_raw_table(sample_records)
+    main_df, _ = create_base_df(engine)
+    monkeypatch.setattr(load_dfs_to_postgres, "chunk_size", len(main_df) // 7 + 1)
+    assert "Error" not in load_dfs_to_postgres.create_chunked_tables_to_postgres()
+    return main_df
+
+
+def sorted_rows(df, columns: list):
+    df = df[columns].astype({column: "object" for column in columns if df[column].dtype == "category"})
+    df = df.sort_values(columns).reset_index(drop=True).astype("object")
+    return df.where(df.notna(), None)  # None, nan and <NA> alike
+
+
+def read_sorted(engine, table_name: str, columns: list):
+    return sorted_rows(pd.read_sql_query(f'SELECT * FROM "{table_name}";', con=engine), columns)
+
+
+def test_geo_grid_matches_pandas(engine, chunked_tables):
+    expected = create_geo_grid(create_df_geo(chunked_tables))
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(read_sorted(engine, f"{table_id}_geo_grid", columns), sorted_rows(expected, columns), check_dtype=False)
+
+
+def test_crime_cube_matches_pandas(engine, chunked_tables):
+    expected = create_crime_cube(chunked_tables)
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(read_sorted(engine, f"{table_id}_crime_cube", columns), sorted_rows(expected, columns), check_dtype=False)
@@ -0,0 +1,39 @@
+"""
+Where the settings come from
+"""
+import os
+import subprocess
+import sys
+import config
+from config import get_setting
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_generic_host_variables_are_ignored(monkeypatch):
+    monkeypatch.setattr(config, "secrets", {})
+    monkeypatch.setenv("PAGE_SIZE", "7")
+    assert get_setting("page_size", 50000) == 50000
+    monkeypatch.setenv("AUSTIN_CRIME_PAGE_SIZE", "8")
+    assert get_setting("page_size", 50000) == "8"
+    monkeypatch.setenv("page_size", "9")
+    assert get_setting("page_size", 50000) == "9"
+
+
+def test_postgres_variables_keep_their_names(monkeypatch):
+    monkeypatch.setattr(config, "secrets", {})
+    monkeypatch.setenv("POSTGRES_PORT", "6543")
+    assert get_setting("postgres_port") == "6543"
+
+
+def test_project_secrets_override_the_global_ones(tmp_path):
+    (tmp_path / ".streamlit").mkdir()
+    (tmp_path / ".streamlit" / "secrets.toml").write_text('chunk_size = 10\npool_size = 3\n')
+    (tmp_path / "secrets.toml").write_text('chunk_size = 20\n')
+    env = {key: value for key, value in os.environ.items() if not key.lower().endswith(("chunk_size", "pool_size"))}
+    env.update({"HOME": str(tmp_path), "SECRETS_PATH": str(tmp_path / "secrets.toml")})
+    output = subprocess.run(
+        [sys.executable, "-c", "import config; print(config.chunk_size, config.pool_size)"],
+        cwd=repository, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    assert output.split() == ["20", "3"]
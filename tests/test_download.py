@@ -0,0 +1,85 @@
+"""
+Paginated, resumable and conditional download of the json file, against a stub of the Socrata API
+"""
+import json
+import os
+import pytest
+from extract_json_to_postgres import download_json_file_from_url, read_download_manifest
+from config import dest_folder, destination_path, download_manifest_path, max_retries
+
+page_size = 5
+
+
+def make_records(n_records: int) -> list:
+    return [{"incident_report_number": str(i), "crime_type": "THEFT"} for i in range(n_records)]
+
+
+def download(stub):
+    return download_json_file_from_url(stub.url, dest_folder, destination_path, page_size=page_size)
+
+
+def downloaded_records() -> list:
+    with open(destination_path) as file:
+        return json.load(file)
+
+
+@pytest.fixture(autouse=True)
+def no_previous_download():
+    for path in [destination_path, f"{destination_path}.part", download_manifest_path]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_pages_are_appended_to_one_json_array(socrata_stub):
+    stub = socrata_stub(make_records(23))
+    logger_msg = download(stub)
+    assert "downloaded successfully" in logger_msg and "(23 records)" in logger_msg
+    assert stub.requests == [0, 5, 10, 15, 20]  # stops at the short last page
+    assert downloaded_records() == stub.records
+    manifest = read_download_manifest()
+    assert manifest["complete"] and [page["records"] for page in manifest["pages"]] == [5, 5, 5, 5, 3]
+
+
+def test_full_last_page_is_followed_by_an_empty_page(socrata_stub):
+    stub = socrata_stub(make_records(20))
+    download(stub)
+    assert stub.requests == [0, 5, 10, 15, 20]
+    assert downloaded_records() == stub.records
+
+
+def test_interrupted_download_resumes_after_its_last_page(socrata_stub):
+    stub = socrata_stub(make_records(23))
+    stub.failures[10] = [500] * (max_retries + 1)
+    logger_msg = download(stub)
+    assert logger_msg.startswith("Error") and "resumes from record 10" in logger_msg
+    assert not os.path.exists(destination_path)
+    assert [page["offset"] for page in read_download_manifest()["pages"]] == [0, 5]
+
+    stub.requests.clear()
+    logger_msg = download(stub)
+    assert "downloaded successfully" in logger_msg
+    assert stub.requests == [10, 15, 20]
+    assert downloaded_records() == stub.records
+
+
+def test_retried_page_is_written_once(socrata_stub):
+    stub = socrata_stub(make_records(12))
+    stub.failures[5] = [503, None, 429]
+    assert "downloaded successfully" in download(stub)
+    assert stub.requests == [0, 5, 5, 5, 5, 10]
+    assert downloaded_records() == stub.records
+
+
+def test_pages_not_modified_are_copied_from_the_previous_file(socrata_stub):
+    stub = socrata_stub(make_records(23))
+    download(stub)
+    stub.records[7] = {"incident_report_number": "7", "crime_type": "BURGLARY"}
+    logger_msg = download(stub)
+    assert "downloaded successfully" in logger_msg
+    assert stub.not_modified == 4  # every page but the second one
+    assert downloaded_records() == stub.records
+
+    logger_msg = download(stub)
+    assert "not modified" in logger_msg
+    assert stub.not_modified == 9
+    assert downloaded_records() == stub.records
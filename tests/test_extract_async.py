@@ -0,0 +1,100 @@
+"""
+Async extract engine against a stub of the Socrata API with injected latency and failures
+"""
+import functools
+import json
+import os
+import httpx
+import pytest
+from extract_async import fetch_pages_async
+from extract_json_to_postgres import download_json_file_from_url, fetch_pages
+from config import dest_folder, destination_path, download_manifest_path, max_retries
+
+page_size = 10
+
+
+def make_records(n_records: int) -> list:
+    return [{"incident_report_number": str(i), "crime_type": "THEFT"} for i in range(n_records)]
+
+
+def fetch_all(pages) -> list:
+    """
+    Records of the pages up to the first short page, as download_json_file_from_url reads them
+    """
+    fetched = []
+    for records, _ in pages:
+        fetched.extend(records)
+        if len(records) < page_size:
+            pages.close()
+            break
+    return fetched
+
+
+def slow_every_third_page(offset: int) -> float:
+    # later pages finish before earlier ones
+    return 0.05 if (offset // page_size) % 3 == 0 else 0.0
+
+
+def test_pages_are_yielded_in_order_and_complete(socrata_stub):
+    stub = socrata_stub(make_records(103), latency=slow_every_third_page)
+    fetched = fetch_all(fetch_pages_async(stub.url, 0, page_size, concurrency=4, requests_per_second=0))
+    assert fetched == stub.records
+    assert sorted(stub.requests) == list(range(0, 110, page_size))
+    assert 1 < stub.max_in_flight <= 4
+
+
+def test_pages_from_an_offset(socrata_stub):
+    stub = socrata_stub(make_records(45), latency=slow_every_third_page)
+    fetched = fetch_all(fetch_pages_async(stub.url, 20, page_size, concurrency=3, requests_per_second=0))
+    assert fetched == stub.records[20:]
+
+
+def download(stub, fetch_pages) -> bytes:
+    for path in [destination_path, f"{destination_path}.part", download_manifest_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    download_json_file_from_url(stub.url, dest_folder, destination_path, page_size=page_size, fetch_pages=fetch_pages)
+    with open(destination_path, "rb") as file:
+        return file.read()
+
+
+def test_download_matches_the_sync_engine(socrata_stub):
+    stub = socrata_stub(make_records(57), latency=slow_every_third_page)
+    content = download(stub, functools.partial(fetch_pages_async, concurrency=4, requests_per_second=0))
+    assert content == download(stub, fetch_pages)
+    assert json.loads(content) == stub.records
+
+
+@pytest.mark.parametrize("failures", [[503], [None], [429, 500, None]])
+def test_transient_failures_are_retried(socrata_stub, failures):
+    stub = socrata_stub(make_records(55))
+    stub.failures[30] = list(failures)
+    fetched = fetch_all(fetch_pages_async(stub.url, 0, page_size, concurrency=4, requests_per_second=0))
+    assert fetched == stub.records
+    assert stub.requests.count(30) == len(failures) + 1
+
+
+@pytest.mark.parametrize("failures, error", [
+    ([404], httpx.HTTPStatusError),
+    ([500] * (max_retries + 1), httpx.HTTPStatusError),
+    ([None] * (max_retries + 1), httpx.TransportError),
+])
+def test_errors_are_raised_to_the_caller(socrata_stub, failures, error):
+    stub = socrata_stub(make_records(55))
+    stub.failures[30] = list(failures)
+    with pytest.raises(error):
+        fetch_all(fetch_pages_async(stub.url, 0, page_size, concurrency=4, requests_per_second=0))
+    assert stub.requests.count(30) == len(failures)
+
+
+@pytest.mark.parametrize("engine_name", ["sync", "async"])
+@pytest.mark.parametrize("failure", [b'[{"incident_report_number": "1"', b"<html>Service Unavailable</html>", 304])
+def test_bad_page_answer_is_a_resumable_error(socrata_stub, engine_name, failure):
+    for path in [destination_path, f"{destination_path}.part", download_manifest_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    stub = socrata_stub(make_records(35))
+    stub.failures[10] = [failure]
+    page_fetcher = fetch_pages if engine_name == "sync" else functools.partial(fetch_pages_async, concurrency=2, requests_per_second=0)
+    logger_msg = download_json_file_from_url(stub.url, dest_folder, destination_path, page_size=page_size, fetch_pages=page_fetcher)
+    assert logger_msg.startswith("Error") and "resumes from record 10" in logger_msg
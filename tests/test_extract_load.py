@@ -0,0 +1,51 @@
+"""
+Download then raw load of write_json_to_postgres_main, against a stub of the Socrata API
+"""
+import json
+import os
+import pytest
+from sqlalchemy import text
+import extract_json_to_postgres
+from extract_json_to_postgres import write_json_to_postgres_main
+from load_dfs_to_postgres import write_pipeline_version
+from config import destination_path, download_manifest_path, raw_table_id
+from conftest import sample_path
+
+
+@pytest.fixture
+def stub(engine, socrata_stub, monkeypatch):
+    for path in [destination_path, f"{destination_path}.part", download_manifest_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    with open(sample_path) as file:
+        stub = socrata_stub(json.load(file)[:40])
+    monkeypatch.setattr(extract_json_to_postgres, "api_url", stub.url)
+    monkeypatch.setattr(extract_json_to_postgres, "extract_mode", "full")
+    return stub
+
+
+def raw_row_count(engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT count(*) FROM "{raw_table_id}";')).scalar()
+
+
+def test_failed_load_is_retried_when_the_download_is_not_modified(engine, stub, monkeypatch):
+    assert "with success" in write_json_to_postgres_main()[1]
+    with engine.begin() as conn:
+        write_pipeline_version(conn)
+    assert "up to date" in write_json_to_postgres_main()[1]
+
+    stub.records = stub.records[:30]
+    with monkeypatch.context() as patch:
+        def fail(destination_path):
+            raise RuntimeError("load failed")
+        patch.setattr(extract_json_to_postgres, "write_to_postgres", fail)
+        patch.setattr(extract_json_to_postgres, "stream_to_postgres", fail)
+        with pytest.raises(RuntimeError):
+            write_json_to_postgres_main()
+    assert raw_row_count(engine) == 40
+
+    logger_msg1, logger_msg2 = write_json_to_postgres_main()
+    assert "not modified" in logger_msg1 and "with success" in logger_msg2
+    assert raw_row_count(engine) == 30
+    assert "up to date" in write_json_to_postgres_main()[1]
@@ -0,0 +1,60 @@
+"""
+Per-stage metrics of the pipeline
+"""
+import threading
+import time
+import pipeline_metrics
+from pipeline_metrics import memory_status, stage
+
+block_megabytes = 100
+
+
+def allocate():
+    block = bytearray(b"x") * (block_megabytes * 10**6)  # written, so resident
+    time.sleep(pipeline_metrics.sample_interval * 10)
+    del block
+
+
+def test_peak_rss_is_measured_per_stage(engine):
+    with stage("large") as large:
+        allocate()
+    with stage("small") as small:
+        pass
+    assert large["peak_rss_mb"] > small["peak_rss_mb"] + block_megabytes * 0.9
+
+
+def test_peak_rss_of_a_stage_survives_a_concurrent_stage(engine):
+    allocated = threading.Event()
+    with stage("outer") as outer:
+        allocate()
+
+        def inner_stage():
+            allocated.wait()
+            with stage("inner"):
+                pass
+
+        thread = threading.Thread(target=inner_stage)
+        thread.start()
+        allocated.set()
+        thread.join()
+    with stage("after") as after:
+        pass
+    assert outer["peak_rss_mb"] > after["peak_rss_mb"] + block_megabytes * 0.9
+
+
+def test_stages_keep_the_process_peak(engine):
+    start_peak = memory_status("VmHWM")
+    with stage("outer"):
+        with stage("allocate"):
+            allocate()
+        with stage("inner"):
+            pass
+    assert memory_status("VmHWM") >= start_peak
+    assert memory_status("VmHWM") > memory_status("VmRSS") + block_megabytes * 0.9
+
+
+def test_peak_rss_without_proc(engine, monkeypatch):
+    monkeypatch.setattr(pipeline_metrics, "memory_status", lambda field: None)
+    with stage("no proc") as metrics:
+        pass
+    assert metrics["peak_rss_mb"] == pipeline_metrics.peak_rss_megabytes()
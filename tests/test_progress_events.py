@@ -0,0 +1,23 @@
+"""
+Progress channel between the pipeline and the 'See The Pipeline' page
+"""
+import os
+from progress_events import emit, read_events, reset_progress
+
+
+def test_events_before_a_run_are_dropped(tmp_path):
+    path = str(tmp_path / "missing_folder" / "progress.jsonl")
+    emit("stage_start", "download", path=path)
+    assert not os.path.exists(path)
+    assert read_events(path=path) == ([], 0)
+
+
+def test_events_of_a_run_are_read_once(tmp_path):
+    path = str(tmp_path / "new_folder" / "progress.jsonl")
+    reset_progress(path)
+    emit("stage_start", "download", path=path)
+    events, position = read_events(path=path)
+    assert [(event["event"], event["stage"]) for event in events] == [("stage_start", "download")]
+    emit("progress", "download", path=path, rows=10)
+    events, _ = read_events(position, path=path)
+    assert [(event["event"], event["rows"]) for event in events] == [("progress", 10)]
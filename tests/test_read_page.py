@@ -0,0 +1,42 @@
+"""
+Keyset pagination of the warehouse tables, with the filters pushed into Postgres
+"""
+import pandas as pd
+import pytest
+from extract_json_to_postgres import replace_raw_table
+from load_dfs_to_postgres import create_sql_tables_to_postgres
+from read_data_from_postgres import read_page, read_table
+from config import table_id
+
+key_columns = ["occurred_date", "incident_report_number"]
+
+
+@pytest.fixture
+def detailed_table(engine, sample_records):
+    replace_raw_table(sample_records)
+    logger_msg = create_sql_tables_to_postgres()
+    assert "success" in logger_msg, logger_msg
+    df = read_table(table_id).dropna(subset=key_columns)
+    return df.sort_values(key_columns, ascending=False).reset_index(drop=True)
+
+
+def read_all_pages(filters: dict, page_size: int = 7):
+    pages, after = [], None
+    while len(pages) == 0 or len(pages[-1]) == page_size:
+        pages.append(read_page(table_id, key_columns, page_size, after, filters))
+        after = tuple(pages[-1].iloc[-1][key_columns]) if len(pages[-1]) else None
+    return pd.concat([page for page in pages if len(page)], ignore_index=True)
+
+
+def test_pages_are_filtered_in_postgres(detailed_table):
+    district = detailed_table["district"].dropna().mode()[0]
+    year = int(detailed_table["occurred_date"].dt.year.mode()[0])
+    expected = detailed_table[(detailed_table["district"] == district) & (detailed_table["occurred_date"].dt.year == year)]
+    df = read_all_pages({"district": district, "year": year, "crime_type": None})
+    assert 0 < len(df) < len(detailed_table)
+    assert df["incident_report_number"].tolist() == expected["incident_report_number"].tolist()
+
+
+def test_unknown_filter_column_is_refused(detailed_table):
+    with pytest.raises(ValueError):
+        read_page(table_id, key_columns, filters={"1 = 1; DROP TABLE x; --": "x"})
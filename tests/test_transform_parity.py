@@ -0,0 +1,47 @@
+"""
+The SQL engine against the pandas reference implementation, on a fixture raw table
+"""
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from extract_json_to_postgres import replace_raw_table
+from transform_create_dfs import create_base_df, top_crimes, top_crimes_from_counts
+from transform_sql import check_parity, transform_queries
+
+# 23 crime types with distinct counts, then 5 tied for the 24th and 25th places, whose order
+# differs between code points and most linguistic collations
+ranked_crime_types = [(f"CRIME {i:02d}", 60 - i) for i in range(23)]
+tied_crime_types = [("assault by threat", 10), ("THEFT OF BICYCLE", 10), ("AUTO THEFT", 10), ("Theft", 10), ("ASSAULT", 10)]
+rare_crime_types = [(f"RARE {i}", 1) for i in range(5)]
+
+
+@pytest.fixture
+def parity_raw_table(engine, sample_records):
+    """
+    Raw table of sample records, with the crime types above
+    """
+    crime_types = [name for name, count in ranked_crime_types + tied_crime_types + rare_crime_types for _ in range(count)]
+    records = sample_records.iloc[[i % len(sample_records) for i in range(len(crime_types))]].reset_index(drop=True)
+    records["incident_report_number"] = pd.array(range(len(crime_types)), dtype="Int64")
+    records["crime_type"] = pd.Series(crime_types, dtype="category")
+    replace_raw_table(records)
+    return engine
+
+
+def test_sql_engine_matches_pandas(parity_raw_table):
+    assert check_parity(parity_raw_table) == []
+
+
+def test_top_crimes_ties_are_broken_by_crime_type(parity_raw_table):
+    expected = sorted([name for name, _ in ranked_crime_types] + ["ASSAULT", "AUTO THEFT"])
+    main_df, _ = create_base_df(parity_raw_table)
+    assert sorted(top_crimes(main_df).index) == expected
+    with parity_raw_table.connect() as conn:
+        assert sorted(conn.execute(text(transform_queries()["_top_crimes"])).scalars()) == expected
+
+
+def test_top_crimes_do_not_depend_on_the_order_of_the_counts():
+    expected = sorted([name for name, _ in ranked_crime_types] + ["ASSAULT", "AUTO THEFT"])
+    counts = dict(ranked_crime_types + tied_crime_types + rare_crime_types)
+    for names in [sorted(counts), sorted(counts, reverse=True)]:
+        assert sorted(top_crimes_from_counts(pd.Series({name: counts[name] for name in names})).index) == expected
@@ -0,0 +1,38 @@
+"""
+Keys and indexes of the warehouse tables, checked on the plans of the dashboard queries
+"""
+import pytest
+import warehouse_ddl
+from extract_json_to_postgres import replace_raw_table
+from load_dfs_to_postgres import create_sql_tables_to_postgres
+from warehouse_ddl import check_index_usage, dashboard_queries
+
+
+@pytest.fixture
+def warehouse(engine, sample_records):
+    replace_raw_table(sample_records)
+    logger_msg = create_sql_tables_to_postgres()
+    assert "success" in logger_msg, logger_msg
+    return engine
+
+
+def test_dashboard_queries_use_indexes(warehouse):
+    # the sample is small enough for a sequential scan to win, so only index plans are allowed
+    results = check_index_usage(warehouse, enable_seqscan=False)
+    assert set(results) == set(dashboard_queries())
+    assert [name for name, uses_index in results.items() if not uses_index] == []
+
+
+def test_record_without_key_does_not_fail_the_indexes(warehouse, sample_records):
+    records = sample_records.copy()
+    records.loc[records.index[0], "incident_report_number"] = None
+    replace_raw_table(records)
+    logger_msg = create_sql_tables_to_postgres()
+    assert "success" in logger_msg, logger_msg
+
+
+def test_partitioned_loads_back_to_back(warehouse, monkeypatch):
+    monkeypatch.setattr(warehouse_ddl, "partition_detailed_table", True)
+    for _ in range(2):
+        logger_msg = create_sql_tables_to_postgres()
+        assert "success" in logger_msg, logger_msg
@@ -0,0 +1,64 @@
+"""
+Materialized view backend, on the sample records
+"""
+import pytest
+from sqlalchemy import text
+import extract_json_to_postgres
+import load_dfs_to_postgres
+from extract_json_to_postgres import replace_raw_table, write_raw_table
+from load_dfs_to_postgres import create_view_tables_to_postgres
+from config import table_id, raw_table_id, version_table_id
+
+
+def scalar(engine, sql: str):
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+@pytest.fixture
+def views_warehouse(engine, sample_records, monkeypatch):
+    monkeypatch.setattr(extract_json_to_postgres, "warehouse_backend", "materialized_views")
+    replace_raw_table(sample_records)
+    logger_msg = create_view_tables_to_postgres()
+    assert "success" in logger_msg, logger_msg
+    return engine
+
+
+def test_refresh_commits_with_the_swap_and_the_version(views_warehouse, sample_records, monkeypatch):
+    version = scalar(views_warehouse, f'SELECT version FROM "{version_table_id}";')
+    n_crimes = scalar(views_warehouse, f'SELECT sum(number_of_crimes) FROM "{table_id}_crimes_per_year";')
+    write_raw_table(sample_records.iloc[10:])
+
+    def failing_swap(conn, tablenames):
+        raise RuntimeError("swap failed")
+
+    monkeypatch.setattr(load_dfs_to_postgres, "swap_staging_tables", failing_swap)
+    assert "swap failed" in create_view_tables_to_postgres()
+    # the views were refreshed in the transaction of the failed swap: nothing changed
+    assert scalar(views_warehouse, f'SELECT version FROM "{version_table_id}";') == version
+    assert scalar(views_warehouse, f'SELECT sum(number_of_crimes) FROM "{table_id}_crimes_per_year";') == n_crimes
+
+    monkeypatch.undo()
+    monkeypatch.setattr(extract_json_to_postgres, "warehouse_backend", "materialized_views")
+    assert "success" in create_view_tables_to_postgres()
+    assert scalar(views_warehouse, f'SELECT version FROM "{version_table_id}";') == version + 1
+    assert scalar(views_warehouse, f'SELECT sum(number_of_crimes) FROM "{table_id}_crimes_per_year";') == n_crimes - 10
+    assert scalar(views_warehouse, f'SELECT count(*) FROM "{table_id}";') == scalar(views_warehouse, f'SELECT count(*) FROM "{raw_table_id}";')
+
+
+def test_geo_refresh_only_rewrites_changed_rows(views_warehouse, sample_records):
+    def geo_row_versions():
+        with views_warehouse.connect() as conn:
+            return dict(conn.execute(text(f'SELECT incident_report_number, xmin::text FROM "{table_id}_geo";')).fetchall())
+
+    before = geo_row_versions()
+    records = sample_records.copy()
+    changed = records["incident_report_number"].isin(before).idxmax()
+    records.loc[changed, "latitude"] += 0.0001
+    write_raw_table(records.drop(records.index[-1]))
+    assert "success" in create_view_tables_to_postgres()
+
+    after = geo_row_versions()
+    rewritten = {key for key in after if before.get(key) != after[key]}
+    assert rewritten == {records.loc[changed, "incident_report_number"]}
+    assert set(before) - set(after) <= {records["incident_report_number"].iloc[-1]}
@@ -1,54 +1,81 @@
 """
 Reads the Postgres table as a dataframe and creates 4 separate dataframes from main table. 
 """
-from sqlalchemy import create_engine
-import streamlit as st
+import numpy as np
 import pandas as pd
+from crime_schema import apply_schema, raw_columns
+from config import raw_table_id
 
+# Side of the square map cells in degrees, from coarse to fine zoom levels
+grid_cell_sizes = [0.02, 0.01, 0.005]
+grid_keys = ["cell_size", "cell_y", "cell_x", "crime_type", "district"]
+# Dimensions of the crime cube
+cube_keys = ["year", "month", "hour", "district", "council_district", "crime_type", "location_type"]
 
-postgres_host = st.secrets.postgres_host
-postgres_database = st.secrets.postgres_database
-postgres_user = st.secrets.postgres_user
-postgres_password = st.secrets.postgres_password
-postgres_port = st.secrets.postgres_port
-dest_folder = st.secrets.dest_folder
-api_url = st.secrets.api_url
-dataset_id = st.secrets.dataset_id
-table_id = st.secrets.table_id
-destination_path = f"{dest_folder}/{dataset_id}.json"
+def raw_table_query() -> str:
+    """
+    Select the raw columns of the raw table (not its row_hash bookkeeping column)
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    return f'SELECT {columns} FROM "{raw_table_id}";'
 
-engine = create_engine(f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_database}')
 
 def create_base_df(engine):
     """
-    Get base dataframe of Austin crime public dataset
+    Get base dataframe of Austin crime public dataset from the raw table written by the extract step
     """
     try:
-        sql = f'SELECT * FROM "{table_id}";'
+        sql = raw_table_query()
         df = pd.read_sql_query(sql, con=engine)
-        logger_msg = f"Table {table_id} loaded successfully from postgresql"
+        logger_msg = f"Table {raw_table_id} loaded successfully from postgresql"
     except Exception as e:
-        logger_msg = f"Error reading table {table_id} from postgresql due to: {e}"
-
-    # Clean data
-    df.rename(columns={"occ_date": "occurred_date"}, inplace=True)
-    df.rename(columns={"rep_date_time": "reported_time"}, inplace=True)
+        logger_msg = f"Error reading table {raw_table_id} from postgresql due to: {e}"
 
     #### Filling nan with average clearance time intervals
     most_common_clearance_date = df["clearance_date"].value_counts().index[1]
     #most_common_clearance_date = datetime.strptime(most_common_clearance_date, '%m/%d/%y %H:%M:%S')
     df[df['clearance_date'].isin(['nan'])]['clearance_date'] = most_common_clearance_date
-    df["occurred_date"] = pd.to_datetime(df["occurred_date"])
-    df["reported_time"] = pd.to_datetime(df["reported_time"])
-    df["clearance_date"] = pd.to_datetime(df["clearance_date"])
+    df = clean_base_df(df)
     return df, logger_msg
 
 
+def clean_base_df(df):
+    """
+    Clean data: rename date columns, parse dates with explicit ISO formats and use
+    categoricals for low-cardinality columns
+    """
+    df = df.rename(columns={"occ_date": "occurred_date", "rep_date_time": "reported_time"})
+    return apply_schema(df, renamed=True)
+
+
+def read_base_df_chunks(engine, chunksize: int):
+    """
+    Read the raw table in batches of chunksize rows through a server-side cursor and clean
+    each batch, so only one batch is in memory at a time. Row labels continue across batches.
+    """
+    sql = raw_table_query()
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+        offset = 0
+        for df in pd.read_sql_query(sql, con=conn, chunksize=chunksize):
+            df.index += offset
+            offset += len(df)
+            yield clean_base_df(df)
+
+
+def combine_counts(partial_dfs: list, key: str):
+    """
+    Merge partial count dataframes (key, number_of_crimes) computed on separate chunks
+    """
+    df = pd.concat(partial_dfs, ignore_index=True)
+    df = df.groupby(key, as_index=False)["number_of_crimes"].sum()
+    return df.sort_values(key).reset_index(drop=True)
+
+
 def create_df_geo(df):
     """
     Create dataframe from Austin crime public dataset with longitude and latitude data
     """
-    df_geo = df[['crime_type', 'district', 'latitude', 'longitude']]
+    df_geo = df[['incident_report_number', 'crime_type', 'district', 'latitude', 'longitude']]
     df_geo = df_geo.dropna(subset=["latitude", "longitude"])
     df_geo.drop(df_geo[df_geo['latitude'] > 32].index, inplace = True)
     df_geo.drop(df_geo[df_geo['latitude'] < 28].index, inplace = True)
@@ -57,6 +84,68 @@ def create_df_geo(df):
     return df_geo
 
 
+def create_geo_grid(df_geo, cell_sizes: list = grid_cell_sizes):
+    """
+    Create dataframe with the number of geocoded crimes per square map cell, crime type and
+    district, at each cell size. Points are binned with vectorized numpy floor division and
+    latitude/longitude are the cell centres.
+    """
+    latitude = df_geo["latitude"].to_numpy(dtype="float64")
+    longitude = df_geo["longitude"].to_numpy(dtype="float64")
+    grids = []
+    for cell_size in cell_sizes:
+        df_cells = pd.DataFrame({
+            "cell_size": cell_size,
+            "cell_y": np.floor(latitude / cell_size).astype("int64"),
+            "cell_x": np.floor(longitude / cell_size).astype("int64"),
+            "crime_type": df_geo["crime_type"].astype("object").to_numpy(),
+            "district": df_geo["district"].astype("object").to_numpy(),
+        })
+        grids.append(df_cells.groupby(grid_keys, dropna=False).size().reset_index(name="number_of_crimes"))
+    return finish_geo_grid(pd.concat(grids, ignore_index=True))
+
+
+def combine_geo_grids(partial_dfs: list):
+    """
+    Merge geo grids computed on separate chunks
+    """
+    df = pd.concat(partial_dfs, ignore_index=True)
+    df = df.groupby(grid_keys, dropna=False, as_index=False)["number_of_crimes"].sum()
+    return finish_geo_grid(df)
+
+
+def finish_geo_grid(df_grid):
+    """
+    Add the cell centre coordinates to the grid counts
+    """
+    df_grid["latitude"] = (df_grid["cell_y"] + 0.5) * df_grid["cell_size"]
+    df_grid["longitude"] = (df_grid["cell_x"] + 0.5) * df_grid["cell_size"]
+    return df_grid[grid_keys + ["latitude", "longitude", "number_of_crimes"]]
+
+
+def create_crime_cube(df):
+    """
+    Create dataframe with the number of crimes per year, month, hour, district, council district,
+    crime type and location type. Any filtered count on these columns is a sum over its rows.
+    Missing values form their own group, so every crime is counted exactly once.
+    """
+    df_cube = pd.DataFrame({
+        "year": df["occurred_date"].dt.year.astype("Int64"),
+        "month": df["occurred_date"].dt.month.astype("Int64"),
+        "hour": df["reported_time"].dt.hour.astype("Int64"),
+        **{column: df[column].astype("object") for column in cube_keys[3:]},
+    })
+    return df_cube.groupby(cube_keys, dropna=False).size().reset_index(name="number_of_crimes")
+
+
+def combine_crime_cubes(partial_dfs: list):
+    """
+    Merge crime cubes computed on separate chunks
+    """
+    df = pd.concat(partial_dfs, ignore_index=True)
+    return df.groupby(cube_keys, dropna=False, as_index=False)["number_of_crimes"].sum()
+
+
 def create_crimes_per_hour(df):
     """
     Create dataframe with number of crimes per hour of the day from Austin crime public dataset
@@ -82,8 +171,19 @@ def top_crimes(df):
     """
     Create dataframe with number of crimes per hour of the day from Austin crime public dataset
     """
-    df_top_crimes = df["crime_type"].value_counts().head(25).reset_index()
+    return top_crimes_from_counts(df["crime_type"].value_counts())
+
+
+def top_crimes_from_counts(crime_counts):
+    """
+    Create the top crimes dataframe from the number of crimes of each crime type
+    """
+    crime_counts = crime_counts[crime_counts > 0]  # categoricals also count unseen categories
+    df_top_crimes = crime_counts.reset_index()
     df_top_crimes.columns = ["crime_type", "number_of_crimes"]
+    df_top_crimes["crime_type"] = df_top_crimes["crime_type"].astype("object")
+    # ties broken by crime type in code point order, as the SQL engines do, so the 25th is always the same
+    df_top_crimes = df_top_crimes.sort_values(["number_of_crimes", "crime_type"], ascending=[False, True]).head(25)
     df_top_crimes = df_top_crimes.groupby(["crime_type"]).sum()
 
     return df_top_crimes
@@ -0,0 +1,160 @@
+"""
+Incremental aggregation: applies the change set recorded by the incremental extract
+({table_id}_raw_changes) to the stored per hour, per year and per crime type counts,
+and to the crime cube, instead of recomputing them from every row of the raw table.
+"""
+from sqlalchemy import inspect, text
+import pandas as pd
+from transform_sql import cube_expressions, transform_queries
+from transform_create_dfs import cube_keys
+from crime_schema import raw_columns
+from config import table_id, raw_table_id, changes_table_id, get_engine
+
+# Aggregate table suffix: (key column, SQL expression of the key over raw columns)
+aggregates = {
+    "_crimes_per_hour": ("hour", "extract(hour FROM rep_date_time)::int"),
+    "_crimes_per_year": ("year", "extract(year FROM occ_date)::int"),
+    "_crime_type_counts": ("crime_type", "crime_type"),
+}
+
+
+def crime_type_counts_query(source_table: str = raw_table_id) -> str:
+    """
+    Count of every crime type: _top_crimes only keeps 25 of them, which is not enough to
+    apply a delta to, so the full counts are stored next to it
+    """
+    return f"""
+        SELECT crime_type, count(*) AS number_of_crimes
+        FROM "{source_table}" WHERE crime_type IS NOT NULL GROUP BY crime_type ORDER BY crime_type
+    """
+
+
+def can_apply_changes(engine) -> bool:
+    """
+    True if there is a change set and every stored aggregate it applies to
+    """
+    tablenames = inspect(engine).get_table_names()
+    return changes_table_id in tablenames and all(f"{table_id}{name}" in tablenames for name in [*aggregates, "_crime_cube"])
+
+
+def create_crime_type_counts(conn, suffix: str = "_staging"):
+    """
+    Full recompute of the crime type counts.
+    Returns the name of the table without the staging suffix.
+    """
+    conn.execute(text(f'DROP TABLE IF EXISTS "{table_id}_crime_type_counts{suffix}";'))
+    conn.execute(text(f'CREATE TABLE "{table_id}_crime_type_counts{suffix}" AS {crime_type_counts_query()};'))
+    return f"{table_id}_crime_type_counts"
+
+
+def clear_changes(conn):
+    """
+    Empty the change set once the aggregates it was applied to are in place (creating it
+    after a full recompute, so the next incremental extract has somewhere to record changes).
+    Run it in the same transaction as the staging swap.
+    """
+    columns = ", ".join(f'"{column}"' for column in raw_columns)
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{changes_table_id}" AS '
+        f'SELECT 1 AS sign, {columns} FROM "{raw_table_id}" WITH NO DATA;'
+    ))
+    conn.execute(text(f'TRUNCATE "{changes_table_id}";'))
+
+
+def apply_changes(conn, suffix: str = "_staging"):
+    """
+    Merge the change set into each stored aggregate as a new staging table: the stored counts
+    plus the sum of +1/-1 signs of the changed rows per key. Keys whose count drops to 0 are removed.
+    Cost depends on the size of the aggregates and of the change set, not on the raw table.
+    Returns the names of the tables without the staging suffix.
+    """
+    tablenames = []
+    for name, (key, expression) in aggregates.items():
+        index_column = '' if name == "_crime_type_counts" else f'(row_number() OVER (ORDER BY {key}) - 1)::bigint AS "index", '
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_id}{name}{suffix}";'))
+        conn.execute(text(f"""
+            CREATE TABLE "{table_id}{name}{suffix}" AS
+            SELECT {index_column}{key}, number_of_crimes
+            FROM (
+                SELECT {key}, sum(number_of_crimes)::bigint AS number_of_crimes
+                FROM (
+                    SELECT {key}, number_of_crimes FROM "{table_id}{name}"
+                    UNION ALL
+                    SELECT {expression} AS {key}, sum(sign) AS number_of_crimes
+                    FROM "{changes_table_id}" WHERE {expression} IS NOT NULL GROUP BY 1
+                ) AS merged
+                GROUP BY {key} HAVING sum(number_of_crimes) > 0
+            ) AS counts
+            ORDER BY {key};
+        """))
+        tablenames.append(f"{table_id}{name}")
+
+    conn.execute(text(f'DROP TABLE IF EXISTS "{table_id}_top_crimes{suffix}";'))
+    conn.execute(text(f"""
+        CREATE TABLE "{table_id}_top_crimes{suffix}" AS
+        SELECT crime_type, number_of_crimes
+        FROM (
+            SELECT crime_type, number_of_crimes FROM "{table_id}_crime_type_counts{suffix}"
+            ORDER BY number_of_crimes DESC, crime_type COLLATE "C" LIMIT 25
+        ) AS top
+        ORDER BY crime_type;
+    """))
+    tablenames.append(f"{table_id}_top_crimes")
+    tablenames.append(apply_cube_changes(conn, suffix))
+    return tablenames
+
+
+def apply_cube_changes(conn, suffix: str = "_staging"):
+    """
+    Merge the change set into the crime cube, as apply_changes does for the one-key aggregates.
+    Missing dimension values are grouped together, as in the full build.
+    Returns the name of the table without the staging suffix.
+    """
+    keys = ", ".join(cube_keys)
+    expressions = ", ".join(f"{cube_expressions[key]} AS {key}" for key in cube_keys)
+    groups = ", ".join(str(i) for i in range(1, len(cube_keys) + 1))
+    conn.execute(text(f'DROP TABLE IF EXISTS "{table_id}_crime_cube{suffix}";'))
+    conn.execute(text(f"""
+        CREATE TABLE "{table_id}_crime_cube{suffix}" AS
+        SELECT {keys}, sum(number_of_crimes)::bigint AS number_of_crimes
+        FROM (
+            SELECT {keys}, number_of_crimes FROM "{table_id}_crime_cube"
+            UNION ALL
+            SELECT {expressions}, sum(sign) AS number_of_crimes
+            FROM "{changes_table_id}" GROUP BY {groups}
+        ) AS merged
+        GROUP BY {groups} HAVING sum(number_of_crimes) > 0;
+    """))
+    return f"{table_id}_crime_cube"
+
+
+def check_consistency(engine):
+    """
+    Compare the stored aggregates with a full recompute from the raw table.
+    Returns the suffixes of the tables whose contents differ.
+    """
+    queries = transform_queries()
+    full_queries = {
+        "_crimes_per_hour": queries["_crimes_per_hour"],
+        "_crimes_per_year": queries["_crimes_per_year"],
+        "_crime_type_counts": crime_type_counts_query(),
+        "_top_crimes": queries["_top_crimes"],
+        "_crime_cube": queries["_crime_cube"],
+    }
+    mismatches = []
+    for name, sql in full_queries.items():
+        full_df = pd.read_sql_query(text(sql), con=engine)
+        stored_df = pd.read_sql_query(text(f'SELECT * FROM "{table_id}{name}";'), con=engine)
+        columns = [column for column in full_df.columns if column != "index"]
+        left = full_df[columns].sort_values(columns).reset_index(drop=True)
+        right = stored_df[columns].sort_values(columns).reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(left, right, check_dtype=False)
+        except AssertionError:
+            mismatches.append(name)
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = check_consistency(get_engine())
+    print ("Stored aggregates match a full recompute" if not mismatches else f"Stored aggregates differ from a full recompute in: {mismatches}")
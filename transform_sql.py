@@ -0,0 +1,158 @@
+"""
+SQL execution engine for the transform step: builds the detailed table and the aggregated
+tables inside Postgres with CREATE TABLE AS, so the raw table never travels through pandas.
+The pandas functions in transform_create_dfs.py remain the reference implementation.
+"""
+from sqlalchemy import text
+import pandas as pd
+from transform_create_dfs import (
+    create_base_df,
+    create_df_geo,
+    create_geo_grid,
+    grid_cell_sizes,
+    create_crime_cube,
+    cube_keys,
+    create_crimes_per_hour,
+    create_crimes_per_year,
+    top_crimes,
+)
+from config import table_id, raw_table_id, get_engine
+
+
+# Geocoded points kept by create_df_geo
+geo_bounds = "latitude BETWEEN 28 AND 32 AND longitude BETWEEN -99 AND -95"
+
+# SQL expression of each crime cube dimension over the raw columns
+cube_expressions = {
+    "year": "extract(year FROM occ_date)::int",
+    "month": "extract(month FROM occ_date)::int",
+    "hour": "extract(hour FROM rep_date_time)::int",
+    "district": "district",
+    "council_district": "council_district",
+    "crime_type": "crime_type",
+    "location_type": "location_type",
+}
+
+
+def transform_queries(source_table: str = raw_table_id) -> dict:
+    """
+    SELECT statements for each output table, keyed by table suffix.
+    Each one mirrors the pandas function of the same table in transform_create_dfs.py.
+    """
+    numbered = f'SELECT row_number() OVER () - 1 AS "index", * FROM "{source_table}"'
+    cell_sizes = ", ".join(f"({cell_size}::float8)" for cell_size in grid_cell_sizes)
+    cube_columns = ", ".join(f"{cube_expressions[key]} AS {key}" for key in cube_keys)
+    cube_groups = ", ".join(str(i) for i in range(1, len(cube_keys) + 1))
+    return {
+        # create_base_df
+        "": f"""
+            SELECT "index", incident_report_number, address, census_tract, clearance_date, clearance_status,
+                council_district, category_description, district, location_type, crime_type, family_violence,
+                occ_date AS occurred_date, rep_date_time AS reported_time, latitude, longitude, year, zipcode
+            FROM ({numbered}) AS raw
+        """,
+        # create_df_geo
+        "_geo": f"""
+            SELECT "index", incident_report_number, crime_type, district, latitude, longitude
+            FROM ({numbered}) AS raw
+            WHERE {geo_bounds}
+        """,
+        # create_geo_grid
+        "_geo_grid": f"""
+            SELECT cell_size, cell_y, cell_x, crime_type, district,
+                (cell_y + 0.5) * cell_size AS latitude, (cell_x + 0.5) * cell_size AS longitude,
+                count(*) AS number_of_crimes
+            FROM (
+                SELECT cell_size, floor(latitude / cell_size)::bigint AS cell_y, floor(longitude / cell_size)::bigint AS cell_x,
+                    crime_type, district
+                FROM "{source_table}" CROSS JOIN (VALUES {cell_sizes}) AS cells (cell_size)
+                WHERE {geo_bounds}
+            ) AS binned
+            GROUP BY cell_size, cell_y, cell_x, crime_type, district
+        """,
+        # create_crimes_per_hour
+        "_crimes_per_hour": f"""
+            SELECT (row_number() OVER (ORDER BY hour) - 1)::bigint AS "index", hour, number_of_crimes
+            FROM (
+                SELECT extract(hour FROM rep_date_time)::int AS hour, count(*) AS number_of_crimes
+                FROM "{source_table}" WHERE rep_date_time IS NOT NULL GROUP BY 1
+            ) AS per_hour
+            ORDER BY hour
+        """,
+        # create_crimes_per_year
+        "_crimes_per_year": f"""
+            SELECT (row_number() OVER (ORDER BY year) - 1)::bigint AS "index", year, number_of_crimes
+            FROM (
+                SELECT extract(year FROM occ_date)::int AS year, count(*) AS number_of_crimes
+                FROM "{source_table}" WHERE occ_date IS NOT NULL GROUP BY 1
+            ) AS per_year
+            ORDER BY year
+        """,
+        # create_crime_cube
+        "_crime_cube": f"""
+            SELECT {cube_columns}, count(*) AS number_of_crimes
+            FROM "{source_table}"
+            GROUP BY {cube_groups}
+        """,
+        # top_crimes
+        "_top_crimes": f"""
+            SELECT crime_type, number_of_crimes
+            FROM (
+                SELECT crime_type, count(*) AS number_of_crimes
+                FROM "{source_table}" WHERE crime_type IS NOT NULL
+                GROUP BY crime_type ORDER BY number_of_crimes DESC, crime_type COLLATE "C" LIMIT 25
+            ) AS top
+            ORDER BY crime_type
+        """,
+    }
+
+
+def create_tables_in_sql(conn, table_id: str = table_id, source_table: str = raw_table_id, suffix: str = "_staging", only: list = None):
+    """
+    Create the output tables (or the table suffixes listed in only) as
+    {table_id}{table suffix}{suffix} inside Postgres.
+    Returns the names of the tables without the staging suffix.
+    """
+    tablenames = []
+    for name, sql in transform_queries(source_table).items():
+        if only is not None and name not in only:
+            continue
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_id}{name}{suffix}";'))
+        conn.execute(text(f'CREATE TABLE "{table_id}{name}{suffix}" AS {sql};'))
+        tablenames.append(f"{table_id}{name}")
+    return tablenames
+
+
+def check_parity(engine):
+    """
+    Compare the SQL engine with the pandas reference implementation on the current raw table.
+    Returns the suffixes of the tables whose contents differ.
+    """
+    main_df, _ = create_base_df(engine)
+    df_geo = create_df_geo(main_df)
+    pandas_dfs = {
+        "_geo": df_geo,
+        "_geo_grid": create_geo_grid(df_geo),
+        "_crimes_per_hour": create_crimes_per_hour(main_df),
+        "_crimes_per_year": create_crimes_per_year(main_df),
+        "_top_crimes": top_crimes(main_df).reset_index(),
+        "_crime_cube": create_crime_cube(main_df),
+    }
+    queries = transform_queries()
+    mismatches = []
+    for name, pandas_df in pandas_dfs.items():
+        sql_df = pd.read_sql_query(text(queries[name]), con=engine).drop(columns="index", errors="ignore")
+        columns = list(sql_df.columns)
+        left = pandas_df[columns].astype({column: "object" for column in columns if pandas_df[column].dtype == "category"})
+        left = left.sort_values(columns).reset_index(drop=True)
+        right = sql_df.sort_values(columns).reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(left, right, check_dtype=False)
+        except AssertionError:
+            mismatches.append(name)
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = check_parity(get_engine())
+    print ("SQL and pandas transforms match" if not mismatches else f"SQL and pandas transforms differ in: {mismatches}")
@@ -0,0 +1,121 @@
+"""
+DDL layer of the warehouse: primary keys, indexes and optional partitioning of the tables
+written by the load step. Everything is built on the staging tables after the bulk load, so
+the rows are loaded without index maintenance and the swap only renames finished tables.
+"""
+import json
+import uuid
+from sqlalchemy import text
+from config import table_id, partition_detailed_table, get_engine
+
+
+# Table suffix: (primary key columns, [index columns, ...])
+warehouse_ddl = {
+    "": (["incident_report_number"], [
+        ["occurred_date", "incident_report_number"],
+        ["reported_time"],
+        ["crime_type"],
+        ["district"],
+    ]),
+    "_geo": (None, [["incident_report_number"], ["crime_type"]]),
+    "_geo_grid": (None, [["cell_size"]]),
+    "_crime_cube": (None, [["year", "month"], ["crime_type"], ["district"], ["location_type"]]),
+}
+
+
+def partition_by_year(conn, table_name: str):
+    """
+    Rebuild a loaded table as a table partitioned by year of occurred_date, one partition per
+    year present plus a default partition for rows without a date
+    """
+    years = [row[0] for row in conn.execute(text(
+        f'SELECT DISTINCT extract(year FROM occurred_date)::int FROM "{table_name}" WHERE occurred_date IS NOT NULL ORDER BY 1;'
+    ))]
+    # unique per load: the partitions of the tables already in place only go when the swap drops them
+    run_token = uuid.uuid4().hex[:12]
+    conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}_partitioned";'))
+    conn.execute(text(f'CREATE TABLE "{table_name}_partitioned" (LIKE "{table_name}") PARTITION BY RANGE (occurred_date);'))
+    for year in years:
+        conn.execute(text(
+            f'CREATE TABLE "{table_id}_{year}_{run_token}" PARTITION OF "{table_name}_partitioned" '
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');"
+        ))
+    conn.execute(text(f'CREATE TABLE "{table_id}_default_{run_token}" PARTITION OF "{table_name}_partitioned" DEFAULT;'))
+    conn.execute(text(f'INSERT INTO "{table_name}_partitioned" SELECT * FROM "{table_name}";'))
+    conn.execute(text(f'DROP TABLE "{table_name}";'))
+    conn.execute(text(f'ALTER TABLE "{table_name}_partitioned" RENAME TO "{table_name}";'))
+
+
+def create_table_ddl(conn, tablenames: list, staging_suffix: str = "_staging"):
+    """
+    Declare the primary key and indexes of each staging table about to be swapped in (after its
+    bulk load). Index names start with the staging table name, so the swap can rename them.
+    """
+    for name in tablenames:
+        suffix = name[len(table_id):]
+        if not name.startswith(table_id) or suffix not in warehouse_ddl:
+            continue
+        primary_key, indexes = warehouse_ddl[suffix]
+        staging_name = f"{name}{staging_suffix}"
+        if suffix == "" and partition_detailed_table:
+            partition_by_year(conn, staging_name)
+            # the partition key must be part of a unique index, and occurred_date can be NULL: no primary key
+            conn.execute(text(
+                f'CREATE UNIQUE INDEX "{staging_name}_pkey" ON "{staging_name}" ({", ".join(primary_key)}, occurred_date);'
+            ))
+        elif primary_key:
+            conn.execute(text(
+                f'ALTER TABLE "{staging_name}" ADD CONSTRAINT "{staging_name}_pkey" '
+                f"PRIMARY KEY ({', '.join(primary_key)});"
+            ))
+        for columns in indexes:
+            index_name = f"{staging_name}_{'_'.join(columns)}_idx"
+            conn.execute(text(f'''CREATE INDEX "{index_name}" ON "{staging_name}" ({', '.join(f'"{column}"' for column in columns)});'''))
+        conn.execute(text(f'ANALYZE "{staging_name}";'))
+
+
+def dashboard_queries(table_id: str = table_id) -> dict:
+    """
+    Representative queries of the dashboard pages, to check with EXPLAIN
+    """
+    return {
+        "latest records": f'SELECT * FROM "{table_id}" WHERE occurred_date IS NOT NULL AND incident_report_number IS NOT NULL '
+                          f'ORDER BY occurred_date DESC, incident_report_number DESC LIMIT 5;',
+        "next page": f'SELECT * FROM "{table_id}" WHERE (occurred_date, incident_report_number) < (now(), 0) '
+                     f'ORDER BY occurred_date DESC, incident_report_number DESC LIMIT 50;',
+        "crimes in a year": f"SELECT count(*) FROM \"{table_id}\" WHERE occurred_date >= make_date(2023, 1, 1) AND occurred_date < make_date(2024, 1, 1);",
+        "crime type filter": f"SELECT location_type, count(*) FROM \"{table_id}\" WHERE crime_type = 'THEFT' GROUP BY 1;",
+        "district filter": f"SELECT location_type, count(*) FROM \"{table_id}\" WHERE district = '3' GROUP BY 1;",
+        "incident lookup": f'SELECT * FROM "{table_id}" WHERE incident_report_number = 0;',
+        "cube slice": f"SELECT hour, sum(number_of_crimes) FROM \"{table_id}_crime_cube\" WHERE crime_type = 'THEFT' AND year = 2023 GROUP BY 1;",
+    }
+
+
+def plan_node_types(plan: dict) -> set:
+    node_types = {plan["Node Type"]}
+    for child in plan.get("Plans", []):
+        node_types |= plan_node_types(child)
+    return node_types
+
+
+def check_index_usage(engine, table_id: str = table_id, enable_seqscan: bool = True) -> dict:
+    """
+    EXPLAIN each dashboard query and tell whether its plan reads an index.
+    On a tiny table Postgres rightly prefers a sequential scan, so run it on a loaded warehouse,
+    or with enable_seqscan False to see whether an index could serve each query at all.
+    """
+    results = {}
+    with engine.connect() as conn:
+        if not enable_seqscan:
+            conn.execute(text("SET LOCAL enable_seqscan = off;"))
+        for name, sql in dashboard_queries(table_id).items():
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            node_types = plan_node_types(plan[0]["Plan"])
+            results[name] = any("Index" in node_type for node_type in node_types)
+    return results
+
+
+if __name__ == "__main__":
+    for name, uses_index in check_index_usage(get_engine()).items():
+        print (f"{name:<20} {'uses an index' if uses_index else 'SEQUENTIAL SCAN'}")
@@ -0,0 +1,96 @@
+"""
+Materialized view backend of the warehouse (warehouse_backend = 'materialized_views'): the
+derived tables are Postgres materialized views of the raw table, defined once with the queries
+of the SQL engine and a unique index each, then refreshed with REFRESH MATERIALIZED VIEW
+CONCURRENTLY after every raw load. The refresh runs inside the database, no derived rows are
+sent over the wire, and readers keep reading the previous contents until it commits.
+"""
+from sqlalchemy import text
+from bulk_load_postgres import drop_relation, relation_columns, relation_kind
+from transform_create_dfs import cube_keys, grid_keys
+from transform_sql import geo_bounds, transform_queries
+from warehouse_ddl import warehouse_ddl
+from config import table_id, raw_table_id, get_engine
+
+
+# View suffix: columns of its unique index, which a concurrent refresh needs to match rows.
+# Rows with a NULL key column are never matched: they are deleted and inserted again.
+materialized_views = {
+    "_geo": ["incident_report_number"],
+    "_geo_grid": grid_keys,
+    "_crimes_per_hour": ["hour"],
+    "_crimes_per_year": ["year"],
+    "_top_crimes": ["crime_type"],
+    "_crime_cube": cube_keys,
+}
+
+
+def view_queries(source_table: str = raw_table_id) -> dict:
+    """
+    Queries of the views: those of the SQL engine, except the geo table's row number "index",
+    which changes for every row after one added or removed and would make each refresh rewrite
+    them all
+    """
+    queries = transform_queries(source_table)
+    queries["_geo"] = f'''
+        SELECT incident_report_number, crime_type, district, latitude, longitude
+        FROM "{source_table}"
+        WHERE {geo_bounds}
+    '''
+    return queries
+
+
+def create_materialized_views(conn, table_id: str = table_id, source_table: str = raw_table_id):
+    """
+    Define the views that do not exist yet, replacing a table of the same name left by the
+    tables backend (or a view without its current key), with their unique index and the
+    indexes declared in warehouse_ddl. A new view is populated when it is created.
+    Returns the names of the views created.
+    """
+    queries = view_queries(source_table)
+    created = []
+    for suffix, key in materialized_views.items():
+        name = f"{table_id}{suffix}"
+        if relation_kind(conn, name) == "m" and set(key) <= set(relation_columns(conn, name)):
+            continue
+        drop_relation(conn, name)
+        conn.execute(text(f'CREATE MATERIALIZED VIEW "{name}" AS {queries[suffix]};'))
+        conn.execute(text(f'''CREATE UNIQUE INDEX "{name}_key" ON "{name}" ({', '.join(f'"{column}"' for column in key)});'''))
+        _, indexes = warehouse_ddl.get(suffix, (None, []))
+        for columns in indexes:
+            if columns != key:
+                conn.execute(text(f'''CREATE INDEX "{name}_{'_'.join(columns)}_idx" ON "{name}" ({', '.join(f'"{column}"' for column in columns)});'''))
+        created.append(name)
+    return created
+
+
+def refresh_materialized_views(conn, table_id: str = table_id, skip: list = ()):
+    """
+    Refresh the views concurrently (except the ones in skip, e.g. just created). Run in one
+    transaction, readers see the new contents of every view at once, when it commits.
+    Returns the names of the views refreshed.
+    """
+    refreshed = []
+    for suffix in materialized_views:
+        name = f"{table_id}{suffix}"
+        if name not in skip:
+            conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{name}";'))
+            refreshed.append(name)
+    return refreshed
+
+
+def drop_materialized_views(conn, table_id: str = table_id):
+    """
+    Drop the views of this backend, e.g. before the raw table they read is replaced by the
+    tables backend
+    """
+    for suffix in materialized_views:
+        if relation_kind(conn, f"{table_id}{suffix}") == "m":
+            conn.execute(text(f'DROP MATERIALIZED VIEW "{table_id}{suffix}";'))
+
+
+if __name__ == "__main__":
+    with get_engine().begin() as conn:
+        created = create_materialized_views(conn)
+        refreshed = refresh_materialized_views(conn, skip=created)
+    print (f"Materialized views created: {created}, refreshed: {refreshed}")